@@ -0,0 +1,401 @@
+import copy
+import threading
+
+# Sound registers always keep their values in IO memory, and the channels'
+# lengths, sweep and envelopes are clocked by the frame sequencer from the
+# cycle count whether or not audio is rendered, so NR52 reads the same either
+# way. That is all the APU does while audio is disabled. With audio enabled
+# every register write is also logged with its cycle, and render()
+# synthesizes the time since the last call in blocks: between two events (a logged write or a frame
+# sequencer step) the channel settings are constant, so each stretch is a
+# handful of NumPy array operations instead of per-sample Python work.
+# numpy is only imported once audio is enabled.
+
+CLOCK_SPEED = 4194304 # base clock, see emulator.py
+
+# channels are synthesized at one sample every SAMPLE_PERIOD cycles
+# (131072 Hz), then resampled to the host rate
+SAMPLE_PERIOD = 32
+# the frame sequencer clocks lengths (256 Hz), sweep (128 Hz) and envelopes (64 Hz)
+SEQUENCER_PERIOD = 8192
+
+NR10 = 0xFF10
+NR50 = 0xFF24
+NR51 = 0xFF25
+NR52 = 0xFF26
+WAVE_RAM = 0xFF30
+
+DUTY_CYCLES = (
+    (0, 0, 0, 0, 0, 0, 0, 1), # 12.5%
+    (1, 0, 0, 0, 0, 0, 0, 1), # 25%
+    (1, 0, 0, 0, 0, 1, 1, 1), # 50%
+    (0, 1, 1, 1, 1, 1, 1, 0), # 75%
+)
+NOISE_DIVISORS = (8, 16, 32, 48, 64, 80, 96, 112)
+WAVE_SHIFTS = (4, 0, 1, 2) # NR32 output level: mute, 100%, 50%, 25%
+
+# bits of 0xFF10-0xFF2F that always read back as 1
+READ_MASKS = bytes((
+    0x80, 0x3F, 0x00, 0xFF, 0xBF, # NR10-NR14
+    0xFF, 0x3F, 0x00, 0xFF, 0xBF, # NR21-NR24
+    0x7F, 0xFF, 0x9F, 0xFF, 0xBF, # NR30-NR34
+    0xFF, 0xFF, 0x00, 0x00, 0xBF, # NR41-NR44
+    0x00, 0x00, 0x70,             # NR50-NR52
+)) + b'\xff' * 9
+
+# noise LFSR output over one period, by width (7 or 15 bits)
+_LFSR = {}
+
+
+def _lfsr_sequence(width):
+    import numpy as np
+    lfsr = 0x7FFF
+    bits = []
+    for step in range(16 + (1 << width) - 1):
+        bit = (lfsr ^ (lfsr >> 1)) & 1
+        lfsr = (lfsr >> 1) | (bit << 14)
+        if width == 7:
+            lfsr = (lfsr & ~0x40) | (bit << 6)
+        if step >= 16: # let the 7-bit mode settle into its loop
+            bits.append(~lfsr & 1)
+    return np.array(bits, dtype=np.float32)
+
+
+class Channel:
+    """ State of one channel """
+    __slots__ = ('on', 'length', 'length_enabled', 'volume', 'envelope_timer',
+                 'frequency', 'phase', 'sweep_timer')
+
+    def __init__(self):
+        self.on = False
+        self.length = 0
+        self.length_enabled = 0
+        self.volume = 0
+        self.envelope_timer = 0
+        self.frequency = 0
+        self.phase = 0.0 # position in the waveform, in waveform steps
+        self.sweep_timer = 0
+
+
+class AudioRing:
+    """ Fixed size ring of int16 stereo frames between the emulation thread
+    and the audio output. Writing past a full ring drops the oldest frames. """
+
+    def __init__(self, frames):
+        import numpy as np
+        self.data = np.zeros((frames, 2), dtype=np.int16)
+        self.written = 0 # frames written and read since creation
+        self.consumed = 0
+        self.lock = threading.Lock()
+
+    def available(self):
+        return self.written - self.consumed
+
+    def write(self, frames):
+        size = len(self.data)
+        frames = frames[-size:]
+        with self.lock:
+            start = self.written % size
+            first = min(len(frames), size - start)
+            self.data[start:start + first] = frames[:first]
+            self.data[:len(frames) - first] = frames[first:]
+            self.written += len(frames)
+            self.consumed = max(self.consumed, self.written - size)
+
+    def read(self, count=None):
+        """ Takes up to count frames (all available by default) """
+        import numpy as np
+        size = len(self.data)
+        with self.lock:
+            available = self.written - self.consumed
+            count = available if count is None else min(count, available)
+            start = self.consumed % size
+            first = min(count, size - start)
+            frames = np.concatenate((self.data[start:start + first], self.data[:count - first]))
+            self.consumed += count
+        return frames
+
+
+class APU:
+    """ The four sound channels: two squares (the first with a frequency
+    sweep), a wave channel and noise. """
+    __slots__ = ('emulator', 'memory', 'io', 'live', 'steps', 'enabled', 'log', 'time',
+                 'regs', 'channels', 'sample_rate', 'output', '_out_time', '_last')
+
+    def __init__(self, emulator):
+        self.emulator = emulator
+        self.memory = emulator.mmu.memory
+        # powered on at full volume with the boot ROM's panning
+        self.memory[NR50] = 0x77
+        self.memory[NR51] = 0xF3
+        self.memory[NR52] = 0x80
+
+        # the channels as the machine sees them (NR52 bits 0-3 are their
+        # on flags), following the registers in IO memory
+        self.io = memoryview(self.memory)[NR10:NR10 + 0x30]
+        self.live = [Channel() for _ in range(4)]
+        self.steps = 0 # frame sequencer steps applied to live, cycle // SEQUENCER_PERIOD
+
+        self.enabled = False
+        self.log = [] # (cycle, address, value) of the writes not rendered yet
+        self.time = 0 # cycle rendered up to
+        self.regs = None # sound registers as of self.time
+        self.channels = None # copy of the channels as of self.time
+        self.sample_rate = 0
+        self.output = None # AudioRing of rendered frames
+        self._out_time = 0.0 # cycle of the next output frame
+        self._last = None # (cycle, left, right) of the last internal sample
+
+    # --- registers ---
+    def read(self, address):
+        memory = self.memory
+        if address == NR52:
+            self.catch_up(self.emulator.cycles)
+            status = 0
+            for number, channel in enumerate(self.live):
+                status |= channel.on << number
+            return (memory[NR52] & 0x80) | 0x70 | status
+        if address >= WAVE_RAM:
+            return memory[address]
+        return memory[address] | READ_MASKS[address - NR10]
+
+    def write(self, address, value):
+        cycle = self.emulator.cycles
+        self.catch_up(cycle)
+        self._apply(self.io, self.live, address, value)
+        if self.enabled:
+            self.log.append((cycle, address, value))
+
+    def catch_up(self, cycle):
+        """ Applies the frame sequencer steps up to cycle to the live channels """
+        steps = cycle // SEQUENCER_PERIOD
+        if steps <= self.steps:
+            return
+        live = self.live
+        # silent channels aren't clocked, so there is nothing to do for them
+        if live[0].on or live[1].on or live[2].on or live[3].on:
+            io = self.io
+            for step in range(self.steps + 1, steps + 1):
+                self._sequence(io, live, step & 7)
+        self.steps = steps
+
+    @staticmethod
+    def _dac(channel, regs):
+        # whether the channel's DAC is on
+        if channel == 2:
+            return regs[0x0A] & 0x80
+        return regs[channel * 5 + 2] & 0xF8
+
+    # --- audio output ---
+    def enable(self, sample_rate=44100, buffer_seconds=0.25):
+        """ Starts logging register writes and rendering them """
+        for width in (7, 15):
+            if width not in _LFSR:
+                _LFSR[width] = _lfsr_sequence(width)
+        self.sample_rate = sample_rate
+        self.output = AudioRing(int(sample_rate * buffer_seconds))
+        self.enabled = True
+        self.reset(self.emulator.cycles)
+
+    def disable(self):
+        self.enabled = False
+        self.log = []
+        self.regs = self.channels = self.output = None
+
+    def reset(self, cycle):
+        """ Restarts synthesis at cycle from the registers in IO memory and
+        the live channels, after enabling or loading a savestate """
+        if not self.enabled:
+            return
+        self.catch_up(cycle)
+        self.log = []
+        self.time = cycle
+        self.regs = bytearray(self.io)
+        self.channels = [copy.copy(channel) for channel in self.live]
+        self._out_time = float(cycle)
+        self._last = None
+
+    def render(self, until):
+        """ Synthesizes up to cycle until into the output ring """
+        import numpy as np
+        if until < self.time:
+            self.reset(until)
+            return
+        log, self.log = self.log, []
+        left, right = [], []
+        time = start = self.time
+        for cycle, address, value in log + [(until, None, None)]:
+            while time < cycle:
+                tick = (time // SEQUENCER_PERIOD + 1) * SEQUENCER_PERIOD
+                end = min(tick, cycle)
+                self._synthesize(time, end, left, right)
+                time = end
+                if time == tick:
+                    self._sequence(self.regs, self.channels, (time // SEQUENCER_PERIOD) & 7)
+            if address is not None:
+                self._apply(self.regs, self.channels, address, value)
+        self.time = time
+
+        if not left:
+            return
+        left = np.concatenate(left)
+        right = np.concatenate(right)
+        first = -(-start // SAMPLE_PERIOD)
+        times = np.arange(first, first + len(left)) * float(SAMPLE_PERIOD)
+        if self._last is not None:
+            times = np.concatenate(([self._last[0]], times))
+            left = np.concatenate(([self._last[1]], left))
+            right = np.concatenate(([self._last[2]], right))
+        self._last = (times[-1], left[-1], right[-1])
+
+        # linear resampling to the host rate
+        step = CLOCK_SPEED / self.sample_rate
+        count = max(0, int((times[-1] - self._out_time) // step) + 1)
+        out_times = self._out_time + np.arange(count) * step
+        self._out_time += count * step
+        frames = np.empty((count, 2), dtype=np.int16)
+        frames[:, 0] = np.interp(out_times, times, left) * 32767
+        frames[:, 1] = np.interp(out_times, times, right) * 32767
+        self.output.write(frames)
+
+    # --- channel state ---
+    # These run on IO memory and the live channels as the CPU writes, and on
+    # self.regs and self.channels as render() replays the logged writes.
+    def _apply(self, regs, channels, address, value):
+        index = address - NR10
+        if address == NR52:
+            if not value & 0x80:
+                # powering off clears every register but wave RAM
+                regs[:NR52 - NR10] = bytes(NR52 - NR10)
+                for channel in channels:
+                    channel.on = False
+            regs[index] = value & 0x80
+            return
+        if address < WAVE_RAM and not regs[NR52 - NR10] & 0x80:
+            return # writes are ignored while powered off
+        regs[index] = value
+        if address >= NR50:
+            return
+
+        number, register = divmod(index, 5)
+        channel = channels[number]
+        if register == 1:
+            channel.length = 256 - value if number == 2 else 64 - (value & 0x3F)
+        elif register == 3:
+            channel.frequency = (channel.frequency & 0x700) | value
+        elif register == 4:
+            channel.frequency = (channel.frequency & 0xFF) | (value & 0x07) << 8
+            channel.length_enabled = value & 0x40
+            if value & 0x80:
+                self._trigger(regs, number, channel)
+        if not self._dac(number, regs):
+            channel.on = False
+
+    def _trigger(self, regs, number, channel):
+        channel.on = bool(self._dac(number, regs))
+        if channel.length == 0:
+            channel.length = 256 if number == 2 else 64
+        if number != 2:
+            envelope = regs[number * 5 + 2]
+            channel.volume = envelope >> 4
+            channel.envelope_timer = envelope & 0x07
+        if number >= 2:
+            channel.phase = 0.0 # the wave position and the LFSR restart
+        if number == 0:
+            sweep = regs[0]
+            channel.sweep_timer = (sweep >> 4 & 0x07) or 8
+            if sweep & 0x07 and self._swept_frequency(regs, channel) > 0x7FF:
+                channel.on = False
+
+    @staticmethod
+    def _swept_frequency(regs, channel):
+        sweep = regs[0]
+        delta = channel.frequency >> (sweep & 0x07)
+        return channel.frequency - delta if sweep & 0x08 else channel.frequency + delta
+
+    def _sequence(self, regs, channels, step):
+        for number, channel in enumerate(channels):
+            if not channel.on:
+                continue
+            if not step & 1 and channel.length_enabled:
+                channel.length -= 1
+                if channel.length <= 0:
+                    channel.on = False
+                    continue
+            if number == 0 and step in (2, 6) and regs[0] & 0x70:
+                channel.sweep_timer -= 1
+                if channel.sweep_timer <= 0:
+                    channel.sweep_timer = (regs[0] >> 4 & 0x07) or 8
+                    if regs[0] & 0x07:
+                        frequency = self._swept_frequency(regs, channel)
+                        if frequency > 0x7FF:
+                            channel.on = False
+                        else:
+                            channel.frequency = frequency
+            if step == 7 and number != 2:
+                envelope = regs[number * 5 + 2]
+                if envelope & 0x07:
+                    channel.envelope_timer -= 1
+                    if channel.envelope_timer <= 0:
+                        channel.envelope_timer = envelope & 0x07
+                        if envelope & 0x08:
+                            channel.volume = min(15, channel.volume + 1)
+                        else:
+                            channel.volume = max(0, channel.volume - 1)
+
+    # --- synthesis ---
+    def _synthesize(self, start, end, left, right):
+        # samples at the multiples of SAMPLE_PERIOD in start..end-1, with the
+        # registers and channel state constant throughout
+        import numpy as np
+        first = -(-start // SAMPLE_PERIOD)
+        count = -(-end // SAMPLE_PERIOD) - first
+        offsets = np.arange(count, dtype=np.float64) * SAMPLE_PERIOD + (first * SAMPLE_PERIOD - start)
+        regs = self.regs
+        panning = regs[NR51 - NR10]
+        mix_left = np.zeros(count, dtype=np.float32)
+        mix_right = np.zeros(count, dtype=np.float32)
+
+        for number, channel in enumerate(self.channels):
+            if not channel.on:
+                continue
+            if number == 2:
+                period = (2048 - channel.frequency) * 2
+                steps = 32
+            elif number == 3:
+                noise = regs[0x12]
+                period = NOISE_DIVISORS[noise & 0x07] << (noise >> 4)
+                steps = len(_LFSR[7 if noise & 0x08 else 15])
+            else:
+                period = (2048 - channel.frequency) * 4
+                steps = 8
+            position = channel.phase
+            channel.phase = (position + (end - start) / period) % steps
+            if not count or not panning & (0x11 << number):
+                continue
+
+            index = (position + offsets / period).astype(np.int64) % steps
+            if number == 2:
+                wave = np.frombuffer(bytes(regs[0x20:0x30]), dtype=np.uint8)
+                samples = np.empty(32, dtype=np.float32)
+                samples[0::2] = wave >> 4
+                samples[1::2] = wave & 0x0F
+                shift = WAVE_SHIFTS[regs[0x0C] >> 5 & 0x03]
+                output = np.floor(samples[index] / (1 << shift)) / 7.5 - 1 if shift < 4 else None
+            elif number == 3:
+                output = (_LFSR[7 if regs[0x12] & 0x08 else 15][index] * 2 - 1) * (channel.volume / 15)
+            else:
+                duty = np.array(DUTY_CYCLES[regs[number * 5 + 1] >> 6], dtype=np.float32)
+                output = (duty[index] * 2 - 1) * (channel.volume / 15)
+            if output is None:
+                continue
+            if panning & (0x10 << number):
+                mix_left += output
+            if panning & (0x01 << number):
+                mix_right += output
+
+        if count:
+            volume = regs[NR50 - NR10]
+            # four channels at up to full scale, times the 1-8 master volume
+            left.append(mix_left * ((volume >> 4 & 0x07) + 1) / 32)
+            right.append(mix_right * ((volume & 0x07) + 1) / 32)
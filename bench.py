@@ -0,0 +1,217 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+from emulator import CYCLES_PER_FRAME, Emulator
+
+# (rom, frame to start measuring from, frames per run)
+DEFAULT_ROMS = [
+    ('roms/cpu_instrs.gb', 30, 10),
+]
+
+
+def _percentile(samples, p):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def measure(run, repeat, warmup):
+    """ Calls run() warmup + repeat times, returns the last repeat results """
+    for _ in range(warmup):
+        run()
+    return [run() for _ in range(repeat)]
+
+
+def bench_cpu(emulator, state, frames):
+    """ Instructions per second for CPU.step alone, the PPU never runs """
+    def run():
+        emulator.load_state(state)
+        step = emulator.cpu.step
+        budget = frames * CYCLES_PER_FRAME
+        cycles = instructions = 0
+        start = time.perf_counter()
+        while cycles < budget:
+            cycles += step()
+            instructions += 1
+        return instructions / (time.perf_counter() - start)
+    return run
+
+
+def bench_cpu_register_file(emulator, state, frames):
+    """ cpu_ips with the registers kept in a bytearray (RegisterFileCPU) """
+    return bench_cpu(Emulator(emulator.mmu.rom, register_file=True), state, frames)
+
+
+def bench_frames(emulator, state, frames):
+    """ Frames per second for the whole headless machine """
+    def run():
+        emulator.load_state(state)
+        start = time.perf_counter()
+        emulator.run_frames(frames)
+        return frames / (time.perf_counter() - start)
+    return run
+
+
+def bench_render(emulator, state, frames):
+    """ Milliseconds to render the 144 scanlines of one frame """
+    def run():
+        emulator.load_state(state)
+        ppu = emulator.ppu
+        memory = emulator.mmu.memory
+        lcdc = memory[0xFF40]
+        memory[0xFF40] = lcdc | 0x81 # make sure LCD and background are on
+        start = time.perf_counter()
+        for _ in range(frames):
+            for ly in range(144):
+                ppu._render_scanline(ly)
+        elapsed = time.perf_counter() - start
+        memory[0xFF40] = lcdc
+        return elapsed * 1000 / frames
+    return run
+
+
+def bench_construct(emulator, state, frames):
+    """ Microseconds to construct an emulator for an already loaded ROM image """
+    rom = emulator.mmu.rom
+    count = 1000
+
+    def run():
+        start = time.perf_counter()
+        for _ in range(count):
+            Emulator(rom)
+        return (time.perf_counter() - start) * 1e6 / count
+    return run
+
+
+def bench_instance_size(emulator, state, frames):
+    """ KiB allocated per emulator instance, the shared ROM image excluded """
+    rom = emulator.mmu.rom
+    count = 100
+
+    def run():
+        tracemalloc.start()
+        instances = [Emulator(rom) for _ in range(count)]
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del instances
+        return size / 1024 / count
+    return run
+
+
+BENCHMARKS = [
+    # name, factory, unit, higher is better
+    ('cpu_ips', bench_cpu, 'instr/s', True),
+    ('cpu_ips_register_file', bench_cpu_register_file, 'instr/s', True),
+    ('fps', bench_frames, 'frames/s', True),
+    ('ppu_frame_ms', bench_render, 'ms', False),
+    ('construct_us', bench_construct, 'us', False),
+    ('instance_kib', bench_instance_size, 'KiB', False),
+]
+
+
+def run_benchmarks(roms, repeat, warmup, frames=None):
+    metrics = {}
+    for rom, start_frame, rom_frames in roms:
+        emulator = Emulator(rom)
+        emulator.run_frames(start_frame)
+        state = bytes(emulator.save_state())
+        for name, factory, unit, higher_is_better in BENCHMARKS:
+            samples = measure(factory(emulator, state, frames or rom_frames), repeat, warmup)
+            metrics[f"{os.path.basename(rom)}:{name}"] = {
+                'median': statistics.median(samples),
+                # tail on the slow side: 5th percentile for throughputs
+                'p95': _percentile(samples, 5 if higher_is_better else 95),
+                'unit': unit,
+                'higher_is_better': higher_is_better,
+                'samples': samples,
+            }
+    return metrics
+
+
+def compare(metrics, baseline, threshold):
+    """ Returns the names of metrics whose median regressed by more than
+    threshold (a fraction) against the baseline """
+    regressions = []
+    for name, metric in metrics.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if metric['higher_is_better']:
+            regressed = metric['median'] < base['median'] * (1 - threshold)
+        else:
+            regressed = metric['median'] > base['median'] * (1 + threshold)
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+
+def print_report(metrics, baseline=None, out=sys.stdout):
+    width = max(len(name) for name in metrics)
+    out.write(f"{'METRIC':<{width}}  {'MEDIAN':>14} {'P95':>14} {'BASELINE':>14}  UNIT\n")
+    for name, metric in metrics.items():
+        base = baseline.get(name) if baseline else None
+        base_text = f"{base['median']:>14.4g}" if base else f"{'-':>14}"
+        out.write(f"{name:<{width}}  {metric['median']:>14.4g} {metric['p95']:>14.4g} "
+                  f"{base_text}  {metric['unit']}\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Emulator benchmarks with regression tracking")
+    parser.add_argument('--rom', action='append', help="ROM to benchmark (repeatable)")
+    parser.add_argument('--frames', type=int, default=None, help="frames per run")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--baseline', default='bench_baseline.json')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help="allowed regression as a fraction of the baseline")
+    parser.add_argument('--save-baseline', action='store_true',
+                        help="store these results as the new baseline")
+    parser.add_argument('--check', action='store_true',
+                        help="fail if there is no baseline to compare against")
+    args = parser.parse_args(argv)
+    if args.check and not os.path.exists(args.baseline):
+        parser.error(f"no baseline at {args.baseline}, make one with --save-baseline first")
+
+    roms = [(rom, DEFAULT_ROMS[0][1], DEFAULT_ROMS[0][2]) for rom in args.rom] if args.rom else DEFAULT_ROMS
+    metrics = run_benchmarks(roms, args.repeat, args.warmup, args.frames)
+
+    results = {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'metrics': metrics,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    baseline = None
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['metrics']
+    print_report(metrics, baseline)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nBaseline saved to {args.baseline}")
+        return 0
+
+    if baseline is None:
+        print(f"\nNo baseline at {args.baseline}, nothing compared "
+              f"(--save-baseline stores one)", file=sys.stderr)
+        return 0
+    regressions = compare(metrics, baseline, args.threshold)
+    if regressions:
+        print(f"\nRegressed by more than {args.threshold:.0%}: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
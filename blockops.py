@@ -0,0 +1,234 @@
+from cpu import CPU
+
+# Block copy and fill loops run as one bytearray slice operation.
+#
+# Each loop is recognised at its head by its exact bytes, ending with the
+# JR NZ back to the head. The run function gets the CPU (pc just past the
+# head opcode) and the address after the loop, and either executes the
+# remaining iterations at once, leaving registers, flags and pc as the last
+# of them would and returning the cycles they take, or returns None to
+# fall back to the head instruction. It falls back when a range leaves
+# plain memory (IO, cartridge registers, CGB banks, debugger watchpoints), wraps
+# around the address space, overwrites the loop itself, or is a forward
+# copy onto an overlapping destination.
+#
+# While the emulator runs to a cycle (a frame end, run_until), cpu.block_budget
+# gives the CPU cycles left before it stops. Only the whole iterations that
+# fit are batched, and the rest run one instruction at a time, so a run stops
+# at the same instruction with or without block operations.
+#
+# The batched iterations land in one CPU step, so the PPU sees the memory
+# after them rather than part way through, and interrupts wait until they
+# are done.
+
+
+def _loop(*body):
+    """ Loop bytes: body followed by JR NZ back to the first byte """
+    return bytes(body) + bytes((0x20, 0x100 - len(body) - 2))
+
+
+def _plain(handlers, handler, start, length):
+    return all(handlers[page] is handler
+               for page in range(start >> 8, ((start + length - 1) >> 8) + 1))
+
+
+def _fit(cpu, n, iteration_cycles):
+    """ How many of the n remaining iterations to batch: all of them, or the
+    whole ones that fit in the cycle budget """
+    budget = cpu.block_budget
+    if budget is None:
+        return n
+    return min(n, budget() // iteration_cycles)
+
+
+def _done(cpu, k, n, end, iteration_cycles):
+    """ Leaves pc after k of n iterations and returns their cycles: JR NZ
+    takes 12 cycles back to the head, 8 falling through after the last """
+    if k < n:
+        cpu.pc -= 1
+        return k * iteration_cycles
+    cpu.pc = end
+    return n * iteration_cycles - 4
+
+
+def _inc_flags(cpu, value):
+    # INC r: Z, H on a carry out of the low nibble, C kept
+    return (0x80 if value == 0 else 0) | (0x20 if value & 0x0F == 0 else 0) | (cpu.f & 0x10)
+
+
+def _dec_flags(cpu, value):
+    # DEC r: Z, N, H on a borrow from the high nibble, C kept
+    return (0x80 if value == 0 else 0) | 0x40 | (0x20 if value & 0x0F == 0x0F else 0) | (cpu.f & 0x10)
+
+
+def _copy(cpu, src, dst, n, loop_start, loop_end):
+    """ Copies n bytes forwards like the loop would, False if it can't """
+    mmu = cpu.mmu
+    if src + n > 0x10000 or dst + n > 0x10000:
+        return False
+    if src < dst < src + n or (dst < loop_end and loop_start < dst + n):
+        return False
+    if not (_plain(mmu.read_map, mmu.read_ram, src, n)
+            and _plain(mmu.write_map, mmu.write_ram, dst, n)):
+        return False
+    memory = mmu.memory
+    memory[dst:dst + n] = memory[src:src + n]
+    return True
+
+
+def _fill(cpu, start, n, loop_start, loop_end):
+    mmu = cpu.mmu
+    if start < 0 or start + n > 0x10000:
+        return False
+    if start < loop_end and loop_start < start + n:
+        return False
+    if not _plain(mmu.write_map, mmu.write_ram, start, n):
+        return False
+    mmu.memory[start:start + n] = bytes((cpu.a,)) * n
+    return True
+
+
+# --- copies ---
+def _copy_hl_de_inc_e(cpu, end):
+    # LD A,(HL+) / LD (DE),A / INC E / JR NZ: until E wraps to 0
+    n = 0x100 - cpu.e
+    k = _fit(cpu, n, 32)
+    src = cpu._get_hl()
+    if not k or not _copy(cpu, src, cpu._get_de(), k, cpu.pc - 1, end):
+        return None
+    cpu.a = cpu.mmu.memory[src + k - 1]
+    cpu._set_hl(src + k)
+    cpu.e = (cpu.e + k) & 0xFF
+    cpu.f = _inc_flags(cpu, cpu.e)
+    return _done(cpu, k, n, end, 32)
+
+
+def _copy_counted(src_pair, counter, iteration_cycles):
+    """ Copy loop advancing both pointers with a DEC B, DEC C or 16-bit BC
+    counter (DEC BC / LD A,B / OR C) """
+    def run(cpu, end):
+        if counter == 'bc':
+            n = cpu._get_bc() or 0x10000
+        else:
+            n = getattr(cpu, counter) or 0x100
+        k = _fit(cpu, n, iteration_cycles)
+        hl = cpu._get_hl()
+        de = cpu._get_de()
+        src, dst = (hl, de) if src_pair == 'hl' else (de, hl)
+        if not k or not _copy(cpu, src, dst, k, cpu.pc - 1, end):
+            return None
+        cpu._set_hl(hl + k)
+        cpu._set_de(de + k)
+        if counter == 'bc':
+            cpu._set_bc(n - k)
+            cpu.a = cpu.b | cpu.c
+            cpu.f = 0x80 if cpu.a == 0 else 0 # OR C
+        else:
+            setattr(cpu, counter, (n - k) & 0xFF)
+            cpu.a = cpu.mmu.memory[src + k - 1]
+            cpu.f = _dec_flags(cpu, getattr(cpu, counter))
+        return _done(cpu, k, n, end, iteration_cycles)
+    return run
+
+
+# --- fills ---
+def _fill_hl_inc_l(cpu, end):
+    # LD (HL),A / INC L / JR NZ: until L wraps to 0
+    n = 0x100 - cpu.l
+    k = _fit(cpu, n, 24)
+    if not k or not _fill(cpu, cpu._get_hl(), k, cpu.pc - 1, end):
+        return None
+    cpu.l = (cpu.l + k) & 0xFF
+    cpu.f = _inc_flags(cpu, cpu.l)
+    return _done(cpu, k, n, end, 24)
+
+
+def _fill_counted(step, counter):
+    """ LD (HL+),A or LD (HL-),A / DEC B or DEC C / JR NZ """
+    def run(cpu, end):
+        n = getattr(cpu, counter) or 0x100
+        k = _fit(cpu, n, 24)
+        hl = cpu._get_hl()
+        start = hl if step > 0 else hl - k + 1
+        if not k or not _fill(cpu, start, k, cpu.pc - 1, end):
+            return None
+        cpu._set_hl(hl + step * k)
+        setattr(cpu, counter, (n - k) & 0xFF)
+        cpu.f = _dec_flags(cpu, getattr(cpu, counter))
+        return _done(cpu, k, n, end, 24)
+    return run
+
+
+# head opcode -> [(loop bytes, run)]
+LOOPS = {
+    0x2A: [
+        (_loop(0x2A, 0x12, 0x1C), _copy_hl_de_inc_e),
+        (_loop(0x2A, 0x12, 0x13, 0x05), _copy_counted('hl', 'b', 40)),
+        (_loop(0x2A, 0x12, 0x13, 0x0D), _copy_counted('hl', 'c', 40)),
+        (_loop(0x2A, 0x12, 0x13, 0x0B, 0x78, 0xB1), _copy_counted('hl', 'bc', 52)),
+    ],
+    0x1A: [
+        (_loop(0x1A, 0x22, 0x13, 0x05), _copy_counted('de', 'b', 40)),
+        (_loop(0x1A, 0x22, 0x13, 0x0D), _copy_counted('de', 'c', 40)),
+        (_loop(0x1A, 0x22, 0x13, 0x0B, 0x78, 0xB1), _copy_counted('de', 'bc', 52)),
+    ],
+    0x77: [
+        (_loop(0x77, 0x2C), _fill_hl_inc_l),
+    ],
+    0x22: [
+        (_loop(0x22, 0x05), _fill_counted(1, 'b')),
+        (_loop(0x22, 0x0D), _fill_counted(1, 'c')),
+    ],
+    0x32: [
+        (_loop(0x32, 0x05), _fill_counted(-1, 'b')),
+        (_loop(0x32, 0x0D), _fill_counted(-1, 'c')),
+    ],
+}
+
+
+def _head(original, loops):
+    # most executions of a head opcode are not a loop, the byte after it
+    # rules nearly all of them out with one lookup
+    by_next = {}
+    for loop, run in loops:
+        by_next.setdefault(loop[1], []).append((loop, run))
+
+    def head(cpu):
+        pc = cpu.pc
+        memory = cpu.mmu.memory
+        candidates = by_next.get(memory[pc & 0xFFFF])
+        if candidates:
+            mmu = cpu.mmu
+            for loop, run in candidates:
+                # code in a CGB bank outside memory is never taken for a loop
+                if (memory[pc - 1:pc - 1 + len(loop)] == loop
+                        and _plain(mmu.read_map, mmu.read_ram, pc - 1, len(loop))):
+                    cycles = run(cpu, pc - 1 + len(loop))
+                    if cycles is not None:
+                        return cycles
+                    break
+        return original(cpu)
+    return head
+
+
+def with_block_ops(opcodes):
+    """ Returns a copy of a dispatch table with the loop heads recognised """
+    return tuple(_head(handler, LOOPS[opcode]) if opcode in LOOPS else handler
+                 for opcode, handler in enumerate(opcodes))
+
+
+OPCODES = with_block_ops(CPU.OPCODES)
+
+# plain class table -> the same with block operations, one per CPU class
+_TABLES = {CPU.OPCODES: OPCODES}
+
+
+def install(cpu):
+    table = _TABLES.get(cpu.OPCODES)
+    if table is None:
+        table = _TABLES[cpu.OPCODES] = with_block_ops(cpu.OPCODES)
+    cpu.opcodes = table
+
+
+def remove(cpu):
+    cpu.opcodes = cpu.OPCODES
@@ -0,0 +1,513 @@
+import argparse
+import random
+import sys
+
+import blockops
+from cpu import CPU, RegisterFileCPU
+from mmu import MMU
+
+# Randomised differential checks of the generated opcode handlers and the
+# block operations. Every opcode runs from random register and memory states
+# through the CPU classes and timing modes and through the small reference
+# interpreter below, which decodes opcodes by their bit fields instead of
+# going through the instruction table. Every recognised loop runs through
+# the block operation table and one instruction at a time through the plain
+# one. Run it after changing instructions.py or blockops.py.
+
+REGISTERS = ('a', 'f', 'b', 'c', 'd', 'e', 'h', 'l', 'sp', 'pc', 'ime', 'ei_delay', 'halted')
+ILLEGAL = {0xD3, 0xDB, 0xDD, 0xE3, 0xE4, 0xEB, 0xEC, 0xED, 0xF4, 0xFC, 0xFD}
+
+
+class FlatMMU:
+    """ 64 KiB of plain memory with the MMU interface the handlers use """
+
+    def __init__(self, memory):
+        self.memory = memory
+        self.ticks = 0
+
+    def read_byte(self, address):
+        return self.memory[address]
+
+    def write_byte(self, address, value):
+        self.memory[address] = value
+
+    def tick(self, cycles):
+        self.ticks += cycles
+
+    def stop(self):
+        pass
+
+
+class Reference:
+    """ Straightforward SM83 interpreter over a dict of registers and a
+    flat memory, one instruction per step() """
+
+    R = ('b', 'c', 'd', 'e', 'h', 'l', None, 'a')
+
+    def __init__(self, state, memory):
+        self.s = dict(state)
+        self.m = memory
+
+    # --- access ---
+    def fetch(self):
+        value = self.m[self.s['pc']]
+        self.s['pc'] = (self.s['pc'] + 1) & 0xFFFF
+        return value
+
+    def fetch_word(self):
+        low = self.fetch()
+        return low | self.fetch() << 8
+
+    def pair(self, name):
+        if name == 'sp':
+            return self.s['sp']
+        return self.s[name[0]] << 8 | self.s[name[1]]
+
+    def set_pair(self, name, value):
+        value &= 0xFFFF
+        if name == 'sp':
+            self.s['sp'] = value
+        elif name == 'af':
+            self.s['a'], self.s['f'] = value >> 8, value & 0xF0
+        else:
+            self.s[name[0]], self.s[name[1]] = value >> 8, value & 0xFF
+
+    def get(self, index):
+        if index == 6:
+            return self.m[self.pair('hl')]
+        return self.s[self.R[index]]
+
+    def put(self, index, value):
+        if index == 6:
+            self.m[self.pair('hl')] = value & 0xFF
+        else:
+            self.s[self.R[index]] = value & 0xFF
+
+    def flag(self, bit):
+        return self.s['f'] >> bit & 1
+
+    def flags(self, z, n, h, c):
+        # None keeps the flag
+        f = self.s['f']
+        for bit, value in ((7, z), (6, n), (5, h), (4, c)):
+            if value is not None:
+                f = f & ~(1 << bit) | (1 << bit if value else 0)
+        self.s['f'] = f & 0xF0
+
+    def push(self, value):
+        sp = self.s['sp']
+        sp = (sp - 1) & 0xFFFF
+        self.m[sp] = value >> 8
+        sp = (sp - 1) & 0xFFFF
+        self.m[sp] = value & 0xFF
+        self.s['sp'] = sp
+
+    def pop(self):
+        sp = self.s['sp']
+        value = self.m[sp] | self.m[(sp + 1) & 0xFFFF] << 8
+        self.s['sp'] = (sp + 2) & 0xFFFF
+        return value
+
+    def condition(self, cc):
+        return (not self.flag(7), self.flag(7), not self.flag(4), self.flag(4))[cc]
+
+    # --- arithmetic ---
+    def alu(self, op, value):
+        a = self.s['a']
+        carry = self.flag(4)
+        if op == 0 or op == 1:
+            c = carry if op == 1 else 0
+            result = a + value + c
+            self.flags(not result & 0xFF, 0, (a & 0xF) + (value & 0xF) + c > 0xF, result > 0xFF)
+        elif op == 2 or op == 3 or op == 7:
+            c = carry if op == 3 else 0
+            result = a - value - c
+            self.flags(not result & 0xFF, 1, (a & 0xF) - (value & 0xF) - c < 0, result < 0)
+            if op == 7:
+                return
+        elif op == 4:
+            result = a & value
+            self.flags(not result, 0, 1, 0)
+        elif op == 5:
+            result = a ^ value
+            self.flags(not result, 0, 0, 0)
+        else:
+            result = a | value
+            self.flags(not result, 0, 0, 0)
+        self.s['a'] = result & 0xFF
+
+    def rotate(self, op, value):
+        carry = self.flag(4)
+        if op == 0:
+            out, result = value >> 7, value << 1 | value >> 7
+        elif op == 1:
+            out, result = value & 1, value >> 1 | value << 7
+        elif op == 2:
+            out, result = value >> 7, value << 1 | carry
+        elif op == 3:
+            out, result = value & 1, value >> 1 | carry << 7
+        elif op == 4:
+            out, result = value >> 7, value << 1
+        elif op == 5:
+            out, result = value & 1, value >> 1 | value & 0x80
+        elif op == 6:
+            out, result = 0, value << 4 | value >> 4
+        else:
+            out, result = value & 1, value >> 1
+        result &= 0xFF
+        self.flags(not result, 0, 0, out)
+        return result
+
+    def add_sp(self):
+        offset = self.fetch()
+        sp = self.s['sp']
+        self.flags(0, 0, (sp & 0xF) + (offset & 0xF) > 0xF, (sp & 0xFF) + offset > 0xFF)
+        return (sp + offset - (0x100 if offset & 0x80 else 0)) & 0xFFFF
+
+    def daa(self):
+        a = self.s['a']
+        carry = self.flag(4)
+        if self.flag(6):
+            if carry:
+                a -= 0x60
+            if self.flag(5):
+                a -= 0x06
+        else:
+            if carry or a > 0x99:
+                a += 0x60
+                carry = 1
+            if self.flag(5) or (a & 0x0F) > 0x09:
+                a += 0x06
+        self.s['a'] = a & 0xFF
+        self.flags(not a & 0xFF, None, 0, carry)
+
+    # --- decoding ---
+    def step(self):
+        op = self.fetch()
+        x, y, z = op >> 6, op >> 3 & 7, op & 7
+        p, q = y >> 1, y & 1
+        rp = ('bc', 'de', 'hl', 'sp')[p]
+        s = self.s
+        if x == 1:
+            if op == 0x76:
+                s['halted'] = 1
+                return 4
+            self.put(y, self.get(z))
+            return 8 if 6 in (y, z) else 4
+        if x == 2:
+            self.alu(y, self.get(z))
+            return 8 if z == 6 else 4
+        if x == 0:
+            if z == 0:
+                if y == 0:
+                    return 4
+                if y == 1:
+                    address = self.fetch_word()
+                    self.m[address] = s['sp'] & 0xFF
+                    self.m[(address + 1) & 0xFFFF] = s['sp'] >> 8
+                    return 20
+                if y == 2:
+                    self.fetch()
+                    return 4
+                offset = self.fetch()
+                if y == 3 or self.condition(y - 4):
+                    s['pc'] = (s['pc'] + offset - (0x100 if offset & 0x80 else 0)) & 0xFFFF
+                    return 12
+                return 8
+            if z == 1:
+                if q == 0:
+                    self.set_pair(rp, self.fetch_word())
+                    return 12
+                hl, value = self.pair('hl'), self.pair(rp)
+                self.set_pair('hl', hl + value)
+                self.flags(None, 0, (hl & 0xFFF) + (value & 0xFFF) > 0xFFF, hl + value > 0xFFFF)
+                return 8
+            if z == 2:
+                address = self.pair(('bc', 'de', 'hl', 'hl')[p])
+                if q == 0:
+                    self.m[address] = s['a']
+                else:
+                    s['a'] = self.m[address]
+                if p == 2:
+                    self.set_pair('hl', address + 1)
+                elif p == 3:
+                    self.set_pair('hl', address - 1)
+                return 8
+            if z == 3:
+                self.set_pair(rp, self.pair(rp) + (1 if q == 0 else -1))
+                return 8
+            if z == 4 or z == 5:
+                value = self.get(y)
+                if z == 4:
+                    result = (value + 1) & 0xFF
+                    self.flags(not result, 0, (value & 0xF) == 0xF, None)
+                else:
+                    result = (value - 1) & 0xFF
+                    self.flags(not result, 1, (value & 0xF) == 0, None)
+                self.put(y, result)
+                return 12 if y == 6 else 4
+            if z == 6:
+                self.put(y, self.fetch())
+                return 12 if y == 6 else 8
+            if y < 4:
+                s['a'] = self.rotate(y, s['a'])
+                self.flags(0, None, None, None)
+            elif y == 4:
+                self.daa()
+            elif y == 5:
+                s['a'] ^= 0xFF
+                self.flags(None, 1, 1, None)
+            elif y == 6:
+                self.flags(None, 0, 0, 1)
+            else:
+                self.flags(None, 0, 0, not self.flag(4))
+            return 4
+
+        # x == 3
+        if z == 0:
+            if y < 4:
+                if self.condition(y):
+                    s['pc'] = self.pop()
+                    return 20
+                return 8
+            if y == 4 or y == 6:
+                address = 0xFF00 | self.fetch()
+                if y == 4:
+                    self.m[address] = s['a']
+                else:
+                    s['a'] = self.m[address]
+                return 12
+            if y == 5:
+                s['sp'] = self.add_sp()
+                return 16
+            self.set_pair('hl', self.add_sp())
+            return 12
+        if z == 1:
+            if q == 0:
+                self.set_pair(('bc', 'de', 'hl', 'af')[p], self.pop())
+                return 12
+            if p == 0 or p == 1:
+                s['pc'] = self.pop()
+                if p == 1:
+                    s['ime'] = 1
+                return 16
+            if p == 2:
+                s['pc'] = self.pair('hl')
+                return 4
+            s['sp'] = self.pair('hl')
+            return 8
+        if z == 2:
+            if y < 4:
+                address = self.fetch_word()
+                if self.condition(y):
+                    s['pc'] = address
+                    return 16
+                return 12
+            address = 0xFF00 | s['c'] if y in (4, 6) else self.fetch_word()
+            if y < 6:
+                self.m[address] = s['a']
+            else:
+                s['a'] = self.m[address]
+            return 8 if y in (4, 6) else 16
+        if z == 3:
+            if y == 0:
+                s['pc'] = self.fetch_word()
+                return 16
+            if y == 1:
+                return self.step_cb()
+            if y == 6:
+                s['ime'] = s['ei_delay'] = 0
+            else:
+                s['ei_delay'] = 1
+            return 4
+        if z == 4 or z == 5:
+            if z == 5 and q == 0:
+                self.push(self.pair(('bc', 'de', 'hl', 'af')[p]) if p < 3 else s['a'] << 8 | s['f'])
+                return 16
+            address = self.fetch_word()
+            if z == 5 or self.condition(y):
+                self.push(s['pc'])
+                s['pc'] = address
+                return 24
+            return 12
+        if z == 6:
+            self.alu(y, self.fetch())
+            return 8
+        self.push(s['pc'])
+        s['pc'] = y * 8
+        return 16
+
+    def step_cb(self):
+        op = self.fetch()
+        x, y, z = op >> 6, op >> 3 & 7, op & 7
+        value = self.get(z)
+        if x == 1:
+            self.flags(not value >> y & 1, 0, 1, None)
+            return 12 if z == 6 else 8
+        if x == 0:
+            value = self.rotate(y, value)
+        elif x == 2:
+            value &= ~(1 << y)
+        else:
+            value |= 1 << y
+        self.put(z, value)
+        return 16 if z == 6 else 8
+
+
+def random_state(rng):
+    state = {name: rng.randrange(256) for name in ('a', 'b', 'c', 'd', 'e', 'h', 'l')}
+    state.update(f=rng.randrange(16) << 4, sp=rng.randrange(0x10000), pc=rng.randrange(0xFFF0),
+                 ime=rng.randrange(2), ei_delay=rng.randrange(2), halted=0)
+    return state
+
+
+def run_handler(cls, opcodes, state, memory):
+    mmu = FlatMMU(memory)
+    cpu = cls(mmu)
+    for name in REGISTERS:
+        setattr(cpu, name, state[name])
+    opcode = memory[cpu.pc]
+    cpu.pc += 1
+    cycles = opcodes[opcode](cpu)
+    return {name: getattr(cpu, name) for name in REGISTERS}, cycles, mmu.ticks
+
+
+def check_handlers(count, rng, out=sys.stdout):
+    """ Runs every opcode count times from random states. Returns the number
+    of mismatches found. """
+    variants = [
+        ('CPU', CPU, CPU.OPCODES),
+        ('RegisterFileCPU', RegisterFileCPU, RegisterFileCPU.OPCODES),
+        ('CPU accurate', CPU, CPU.ACCURATE_OPCODES),
+        ('RegisterFileCPU accurate', RegisterFileCPU, RegisterFileCPU.ACCURATE_OPCODES),
+    ]
+    failures = 0
+    base = bytearray(rng.randbytes(0x10000))
+    opcodes = [op for op in range(256) if op not in ILLEGAL]
+    prefixed = [(0xCB, cb) for cb in range(256)]
+    for _ in range(count):
+        for code in [(op,) for op in opcodes] + prefixed:
+            state = random_state(rng)
+            memory = bytearray(base)
+            for i, byte in enumerate(code):
+                memory[state['pc'] + i] = byte
+            reference = Reference(state, bytearray(memory))
+            expected_cycles = reference.step()
+            for name, cls, table in variants:
+                mine = bytearray(memory)
+                registers, cycles, ticks = run_handler(cls, table, state, mine)
+                problems = []
+                if registers != reference.s:
+                    problems += [f"{r} {registers[r]:#x} != {reference.s[r]:#x}"
+                                 for r in REGISTERS if registers[r] != reference.s[r]]
+                if cycles != expected_cycles:
+                    problems.append(f"cycles {cycles} != {expected_cycles}")
+                if ticks > cycles:
+                    problems.append(f"ticked {ticks} of {cycles} cycles")
+                if mine != reference.m:
+                    address = next(i for i in range(0x10000) if mine[i] != reference.m[i])
+                    problems.append(f"memory at {address:#06x} {mine[address]:#04x} "
+                                    f"!= {reference.m[address]:#04x}")
+                if problems:
+                    failures += 1
+                    code_text = ' '.join(f'{byte:02X}' for byte in code)
+                    out.write(f"{name} {code_text} from {state}: {'; '.join(problems)}\n")
+    return failures
+
+
+def run_loop(opcodes, state, memory, end, limit=1 << 22):
+    """ Runs from state until pc leaves the loop ending at end (normally
+    at end, or anywhere once the loop has overwritten itself) or limit
+    cycles have run, the limit being the block operations' budget like a
+    frame end is in the emulator. Returns (registers, cycles, memory, error). """
+    mmu = MMU()
+    mmu.memory[:] = memory
+    cpu = CPU(mmu)
+    for name in REGISTERS:
+        setattr(cpu, name, state[name])
+    start = cpu.pc
+    cycles = 0
+    cpu.block_budget = lambda: limit - cycles
+    error = None
+    try:
+        while start <= cpu.pc < end and cycles < limit:
+            opcode = mmu.read_byte(cpu.pc)
+            cpu.pc += 1
+            cycles += opcodes[opcode](cpu)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    return {name: getattr(cpu, name) for name in REGISTERS}, cycles, mmu.memory, error
+
+
+def check_blockops(count, rng, out=sys.stdout):
+    """ Runs every recognised loop count times from random states, with its
+    pointers sometimes next to the loop itself or reaching outside plain
+    memory so the fallbacks are covered too, and sometimes a cycle limit
+    ending the run inside the loop. Returns the number of mismatches. """
+    failures = 0
+    loops = [loop for head in blockops.LOOPS.values() for loop, _ in head]
+    for _ in range(count):
+        for loop in loops:
+            state = random_state(rng)
+            pc = rng.randrange(0xC000, 0xE000 - len(loop))
+            for pair in ('bc', 'de', 'hl'):
+                if pair == 'bc':
+                    # keep the 16-bit counters short enough to interpret
+                    value = rng.randrange(1, 0x300)
+                elif rng.random() < 0.2:
+                    value = pc + rng.randrange(-0x100, 0x100)
+                else:
+                    value = rng.randrange(0x8000, 0xFA00)
+                state[pair[0]], state[pair[1]] = value >> 8, value & 0xFF
+            state.update(pc=pc, ime=0, ei_delay=0)
+
+            memory = bytearray(0x10000)
+            memory[0x8000:0xFE00] = rng.randbytes(0x7E00)
+            memory[pc:pc + len(loop)] = loop
+            end = pc + len(loop)
+            # stop part way through the loop now and then
+            limit = rng.randrange(1, 0x1000) if rng.random() < 0.3 else 1 << 22
+            expected = run_loop(CPU.OPCODES, state, memory, end, limit)
+            registers, cycles, mine, error = run_loop(blockops.OPCODES, state, memory, end, limit)
+            problems = [f"{r} {registers[r]:#x} != {expected[0][r]:#x}"
+                        for r in REGISTERS if registers[r] != expected[0][r]]
+            if cycles != expected[1]:
+                problems.append(f"cycles {cycles} != {expected[1]}")
+            if error != expected[3]:
+                problems.append(f"{error} != {expected[3]}")
+            if mine != expected[2]:
+                address = next(i for i in range(0x10000) if mine[i] != expected[2][i])
+                problems.append(f"memory at {address:#06x} {mine[address]:#04x} "
+                                f"!= {expected[2][address]:#04x}")
+            if problems:
+                failures += 1
+                out.write(f"loop {loop.hex(' ')} from {state}: {'; '.join(problems)}\n")
+    return failures
+
+
+CHECKS = {'handlers': check_handlers, 'blockops': check_blockops}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Randomised differential checks of the opcode handlers "
+                                                 "and block operations")
+    parser.add_argument('checks', nargs='*', help=f"checks to run: {', '.join(sorted(CHECKS))} "
+                                                  f"(all by default)")
+    parser.add_argument('--count', type=int, default=100, help="random states per opcode or loop")
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    for name in args.checks:
+        if name not in CHECKS:
+            parser.error(f"unknown check '{name}'")
+    seed = args.seed if args.seed is not None else random.randrange(1 << 32)
+    failures = 0
+    for name in args.checks or sorted(CHECKS, reverse=True):
+        found = CHECKS[name](args.count, random.Random(seed))
+        print(f"{name}: {found} mismatches (seed {seed})")
+        failures += found
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,311 @@
+import hooks
+
+
+class DebugBreak(Exception):
+    """ Raised out of the emulator loop when a breakpoint or watchpoint fires.
+    The CPU is left about to execute the instruction at pc. """
+
+    def __init__(self, reason, pc, address=None, value=None):
+        detail = f" {address:#06x}={value:#04x}" if address is not None else ""
+        super().__init__(f"{reason} at pc {pc:#06x}{detail}")
+        self.reason = reason
+        self.pc = pc
+        self.address = address
+        self.value = value
+
+
+class Debugger:
+    """ PC breakpoints, read/write watchpoints and break-on-opcode.
+
+    Nothing is checked on the normal path: arming a hook swaps only the
+    affected entries, the dispatch entries of the opcodes involved and the
+    MMU page handlers of the watched pages, for checking wrappers. A PC
+    breakpoint wraps the opcode found at that address, looked up again
+    whenever the byte there can change: on writes to it and on ROM and CGB
+    bank switches. A watchpoint that fires mid-instruction lets the
+    instruction finish and breaks before the next one by briefly swapping
+    in a trap table. """
+
+    def __init__(self, emulator):
+        self.emulator = emulator
+        self.breakpoints = set()
+        self.break_opcodes = set()    # 0x00-0xFF, or 0xCB00-0xCBFF for CB opcodes
+        self.watchpoints = []         # (start, end, on read, on write)
+        self.hit = None
+
+        self._opcodes = {}            # opcode -> original dispatch entry
+        self._cbcodes = {}
+        self._tables = None           # dispatch tables to go back to when unpatched
+        self._reads = {}              # page -> original read handler
+        self._writes = {}
+        self._resume_pc = None
+        self._trapped = None          # (dispatch table, reason, address, value) of an armed trap
+        self._resync = False          # breakpoint opcodes changed while a trap was armed
+
+    # --- arming ---
+    def add_breakpoint(self, pc):
+        self.breakpoints.add(pc)
+        self._sync_opcodes()
+        self._sync_pages()
+
+    def remove_breakpoint(self, pc):
+        self.breakpoints.discard(pc)
+        self._sync_opcodes()
+        self._sync_pages()
+
+    def break_on_opcode(self, opcode):
+        self.break_opcodes.add(opcode)
+        self._sync_opcodes()
+
+    def remove_opcode_break(self, opcode):
+        self.break_opcodes.discard(opcode)
+        self._sync_opcodes()
+
+    def add_watchpoint(self, start, end=None, read=False, write=True):
+        """ Breaks on accesses to start..end (inclusive) """
+        end = start if end is None else end
+        self.watchpoints.append((start, end, read, write))
+        self._sync_pages()
+
+    def remove_watchpoint(self, start, end=None):
+        end = start if end is None else end
+        self.watchpoints = [w for w in self.watchpoints if (w[0], w[1]) != (start, end)]
+        self._sync_pages()
+
+    def clear(self):
+        self.breakpoints.clear()
+        self.break_opcodes.clear()
+        self.watchpoints = []
+        self._sync_opcodes()
+        self._sync_pages()
+
+    # --- running ---
+    def run_frames(self, n):
+        """ Runs up to n frames. Returns the DebugBreak that stopped them, or None """
+        emulator = self.emulator
+        if self._resume_pc is not None:
+            # the resumed instruction runs on its own, so the pc is let
+            # through once whether or not any opcode entries are wrapped
+            frame = emulator.frame
+            hit = self._step()
+            if hit is not None:
+                return hit
+            n -= emulator.frame - frame
+        try:
+            emulator.run_frames(n)
+        except DebugBreak as hit:
+            self.hit = hit
+            return hit
+        return None
+
+    def step(self):
+        """ Executes one instruction, ignoring a breakpoint at the current pc """
+        self.resume()
+        return self._step()
+
+    def _step(self):
+        try:
+            self.emulator.step()
+        except DebugBreak as hit:
+            self.hit = hit
+            return hit
+        finally:
+            self._resume_pc = None
+        if self._trapped is not None:
+            # a watchpoint hit by this instruction breaks now rather than
+            # at the start of the next step
+            self.hit = self._spring()
+            return self.hit
+        return None
+
+    def resume(self):
+        """ Lets the instruction at the current pc run once without breaking,
+        so running again continues past the last break """
+        self._resume_pc = self.emulator.cpu.pc
+
+    # --- dispatch table entries ---
+    def _sync_opcodes(self):
+        if self._trapped is not None:
+            # the trap table is in place, sync once it has fired
+            self._resync = True
+            return
+        cpu = self.emulator.cpu
+        wanted = {self._peek(pc) for pc in self.breakpoints}
+        wanted |= {op for op in self.break_opcodes if op <= 0xFF}
+        if any(op > 0xFF for op in self.break_opcodes):
+            wanted.add(0xCB)
+        cb_wanted = {op & 0xFF for op in self.break_opcodes if op > 0xFF}
+
+        if self._tables is None:
+            if not wanted and not cb_wanted:
+                return
+            # patch copies of the plain class tables, which also stops block
+            # operations from running past breakpoints inside a loop. Accurate
+            # timing mode keeps its own tables.
+            self._tables = cpu.opcodes, cpu.cbcodes
+            if cpu.cbcodes is cpu.ACCURATE_CB_OPCODES:
+                cpu.opcodes = list(cpu.ACCURATE_OPCODES)
+                cpu.cbcodes = list(cpu.ACCURATE_CB_OPCODES)
+            else:
+                cpu.opcodes = list(cpu.OPCODES)
+                cpu.cbcodes = list(cpu.CB_OPCODES)
+
+        self._sync_table(cpu.opcodes, self._opcodes, wanted, self._check_opcode)
+        self._sync_table(cpu.cbcodes, self._cbcodes, cb_wanted, self._check_cbcode)
+        if not self._opcodes and not self._cbcodes:
+            cpu.opcodes, cpu.cbcodes = self._tables
+            self._tables = None
+
+    def _peek(self, address):
+        # the byte at address in the current banks, without debug checks or
+        # accurate timing ticks
+        page = address >> 8
+        return self._reads.get(page, self.emulator.mmu.read_map[page])(address)
+
+    def _sync_table(self, table, originals, wanted, make_check):
+        for op in list(originals):
+            if op not in wanted:
+                table[op] = originals.pop(op)
+        for op in wanted:
+            if op not in originals:
+                originals[op] = table[op]
+                table[op] = make_check(op, originals[op])
+
+    def _check_opcode(self, opcode, original):
+        def check(cpu):
+            pc = cpu.pc - 1
+            if pc == self._resume_pc:
+                self._resume_pc = None
+            elif pc in self.breakpoints:
+                cpu.pc = pc
+                raise DebugBreak('breakpoint', pc)
+            elif opcode in self.break_opcodes:
+                cpu.pc = pc
+                raise DebugBreak('opcode', pc)
+            return original(cpu)
+        return check
+
+    def _check_cbcode(self, opcode, original):
+        def check(cpu):
+            pc = cpu.pc - 2
+            if pc == self._resume_pc:
+                self._resume_pc = None
+            elif (0xCB00 | opcode) in self.break_opcodes:
+                cpu.pc = pc
+                raise DebugBreak('opcode', pc)
+            return original(cpu)
+        return check
+
+    # --- MMU page entries ---
+    def _sync_pages(self):
+        self._unwrap_pages()
+        self._wrap_pages()
+
+    def _unwrap_pages(self):
+        mmu = self.emulator.mmu
+        for page in list(self._reads):
+            mmu.read_map[page] = self._reads.pop(page)
+        for page in list(self._writes):
+            mmu.write_map[page] = self._writes.pop(page)
+
+    def _wrap_pages(self):
+        mmu = self.emulator.mmu
+        read_pages = {}
+        write_pages = {}
+        for watch in self.watchpoints:
+            start, end, on_read, on_write = watch
+            for page in range(start >> 8, (end >> 8) + 1):
+                if on_read:
+                    read_pages.setdefault(page, []).append(watch)
+                if on_write:
+                    write_pages.setdefault(page, []).append(watch)
+
+        for page, watches in read_pages.items():
+            self._reads[page] = mmu.read_map[page]
+            mmu.read_map[page] = self._check_read(self._reads[page], watches)
+        for page, watches in write_pages.items():
+            self._writes[page] = mmu.write_map[page]
+            mmu.write_map[page] = self._check_write(self._writes[page], watches)
+
+        # code written over a breakpoint outside ROM (the usual OAM DMA
+        # routine copied to HRAM, ...) changes the opcode to wrap. ROM
+        # writes go to the bank controller, see map_rom_bank below.
+        for page in {pc >> 8 for pc in self.breakpoints if pc >= 0x8000}:
+            self._writes.setdefault(page, mmu.write_map[page])
+            mmu.write_map[page] = self._check_code(mmu.write_map[page])
+
+        # ROM and CGB bank switches replace memory and page entries: watched
+        # pages are wrapped again around the new ones and the breakpoint
+        # opcodes looked up again
+        wanted = bool(self.watchpoints or self.breakpoints)
+        if wanted and not hooks.installed(mmu, self):
+            hooks.install(mmu, self, {'map_pages': self._map_pages_wrapper,
+                                      'map_rom_bank': self._map_rom_bank_wrapper})
+        elif not wanted and hooks.installed(mmu, self):
+            hooks.remove(mmu, self)
+
+    def _map_pages_wrapper(self, inner):
+        def map_pages(mmu, first, last, read, write):
+            self._unwrap_pages()
+            inner(mmu, first, last, read, write)
+            self._wrap_pages()
+            if self.breakpoints:
+                self._sync_opcodes()
+        return map_pages
+
+    def _map_rom_bank_wrapper(self, inner):
+        def map_rom_bank(mmu):
+            inner(mmu)
+            if self.breakpoints:
+                self._sync_opcodes()
+        return map_rom_bank
+
+    def _check_code(self, original):
+        def check(address, value):
+            original(address, value)
+            if address in self.breakpoints:
+                self._sync_opcodes()
+        return check
+
+    def _check_read(self, original, watches):
+        def check(address):
+            value = original(address)
+            for start, end, _, _ in watches:
+                if start <= address <= end:
+                    self._trap('read', address, value)
+                    break
+            return value
+        return check
+
+    def _check_write(self, original, watches):
+        def check(address, value):
+            original(address, value)
+            for start, end, _, _ in watches:
+                if start <= address <= end:
+                    self._trap('write', address, value)
+                    break
+        return check
+
+    def _trap(self, reason, address, value):
+        """ Breaks before the next instruction: every dispatch entry is
+        swapped for a trap until it fires. An instruction accessing several
+        watched bytes (PUSH, CALL, ...) breaks once, on the first. """
+        cpu = self.emulator.cpu
+        if self._trapped is not None:
+            return
+        self._trapped = cpu.opcodes, reason, address, value
+
+        def trap(cpu):
+            cpu.pc -= 1
+            raise self._spring()
+        cpu.opcodes = (trap,) * 256
+
+    def _spring(self):
+        # puts the real dispatch table back, returns the break of the armed trap
+        cpu = self.emulator.cpu
+        cpu.opcodes, reason, address, value = self._trapped
+        self._trapped = None
+        if self._resync:
+            self._resync = False
+            self._sync_opcodes()
+        return DebugBreak(reason, cpu.pc, address, value)
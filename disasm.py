@@ -0,0 +1,51 @@
+from instructions import CB_MNEMONICS, MNEMONICS
+
+
+def instruction_length(opcode):
+    mnemonic = MNEMONICS[opcode]
+    if opcode == 0xCB:
+        return 2
+    if 'd16' in mnemonic or 'a16' in mnemonic:
+        return 3
+    if 'd8' in mnemonic or 'r8' in mnemonic or 'a8' in mnemonic:
+        return 2
+    return 1
+
+
+def disassemble(read_byte, address):
+    """ Returns (text, length) of the instruction at address """
+    opcode = read_byte(address)
+    if opcode == 0xCB:
+        return CB_MNEMONICS[read_byte((address + 1) & 0xFFFF)], 2
+
+    text = MNEMONICS[opcode]
+    length = instruction_length(opcode)
+    if length == 3:
+        word = read_byte((address + 1) & 0xFFFF) | (read_byte((address + 2) & 0xFFFF) << 8)
+        text = text.replace('d16', f'${word:04X}').replace('a16', f'${word:04X}')
+    elif length == 2:
+        byte = read_byte((address + 1) & 0xFFFF)
+        if 'r8' in text:
+            offset = byte - 0x100 if byte > 0x7F else byte
+            if text.startswith('JR'):
+                text = text.replace('r8', f'${(address + 2 + offset) & 0xFFFF:04X}')
+            else:
+                text = text.replace('r8', f'{offset:+d}')
+        elif 'a8' in text:
+            text = text.replace('a8', f'$FF{byte:02X}')
+        else:
+            text = text.replace('d8', f'${byte:02X}')
+    return text, length
+
+
+def disassemble_range(read_byte, start, end):
+    """ Lists (address, raw bytes, text) for the instructions from start up to
+    and including the one at end """
+    lines = []
+    address = start
+    while address <= end:
+        text, length = disassemble(read_byte, address)
+        raw = bytes(read_byte((address + i) & 0xFFFF) for i in range(length))
+        lines.append((address, raw, text))
+        address += length
+    return lines
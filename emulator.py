@@ -0,0 +1,252 @@
+from apu import APU
+from cpu import CPU, RegisterFileCPU
+from mmu import MMU
+from ppu import PPU
+from timer import Timer
+import blockops
+import hooks
+import joypad
+import savestate
+
+# Gameboy clock speed is 4.194304 MHz. A frame is 154 scanlines of 456 dots,
+# 70224 cycles, which gives ~59.73 frames per second.
+CLOCK_SPEED = 4194304
+CYCLES_PER_FRAME = 154 * 456
+FRAME_RATE = CLOCK_SPEED / CYCLES_PER_FRAME
+
+
+class Emulator:
+    """ Headless Gameboy core: CPU, MMU, PPU and timer without any display.
+    register_file=True keeps the CPU registers in a single bytearray
+    (see RegisterFileCPU); it is experimental, and slower than the default
+    CPU under CPython, up to about 40%. block_ops=False runs copy and fill loops one
+    instruction at a time instead of as slice operations (see blockops.py).
+
+    accurate=True ticks the PPU and timer at every M-cycle of an instruction
+    instead of once after it, so each memory access sees the machine as it
+    is at that M-cycle, STAT's mode and LY=LYC bits included. It runs about
+    a quarter slower and turns block operations off; the default fast mode batches whole instructions. """
+
+    def __init__(self, rom=None, register_file=False, block_ops=True, accurate=False):
+        self.mmu = MMU()
+        self.cpu = (RegisterFileCPU if register_file else CPU)(self.mmu)
+        self.ppu = PPU(self.mmu, self.cpu)
+        self.mmu.ppu = self.ppu
+        self.timer = Timer(self.mmu)
+        self.mmu.timer = self.timer
+
+        # total cycles since power on, at the base clock: in CGB double speed
+        # mode a CPU cycle counts half
+        self.cycles = 0
+
+        # keeps the sound registers and clocks the channels; synthesizes audio
+        # once enable_audio() is called
+        self.apu = APU(self)
+        self.mmu.apu = self.apu
+
+        self.accurate = accurate
+        self.block_ops = block_ops and not accurate
+        # cycles already ticked by the instruction being executed (accurate mode)
+        self._elapsed = 0
+        # cycle the run in progress stops at, for the block operations' budget
+        self._target = 0
+        if accurate:
+            self.cpu.opcodes = self.cpu.ACCURATE_OPCODES
+            self.cpu.cbcodes = self.cpu.ACCURATE_CB_OPCODES
+            hooks.install(self.mmu, self, self._timing_hooks())
+        elif self.block_ops:
+            blockops.install(self.cpu)
+
+        if rom is not None:
+            self.load_rom(rom)
+
+    def load_rom(self, rom):
+        """ Loads a ROM from bytes or from a file path """
+        if not isinstance(rom, (bytes, bytearray, memoryview)):
+            with open(rom, 'rb') as f:
+                rom = f.read()
+        self.mmu.load_rom_data(rom)
+        if self.mmu.cgb:
+            self.cpu.a = 0x11 # how the boot ROM tells games they run on a CGB
+
+    @property
+    def frame(self):
+        """ Number of completed frames """
+        return self.cycles // CYCLES_PER_FRAME
+
+    @property
+    def framebuffer(self):
+        """ 160x144 shade indices (0-3), row major """
+        return self.ppu.framebuffer
+
+    def read_memory(self, address, length=1):
+        read_byte = self.mmu.read_byte
+        return bytes(read_byte((address + i) & 0xFFFF) for i in range(length))
+
+    def read_wram(self):
+        """ Work RAM: 0xC000-0xDFFF, or every bank in order in CGB mode """
+        if self.mmu.cgb:
+            return b''.join(self.mmu.wram)
+        return bytes(self.mmu.memory[0xC000:0xE000])
+
+    def save_state(self, out=None):
+        """ Snapshot of the whole machine as a versioned binary blob """
+        return savestate.save_state(self, out)
+
+    def load_state(self, data):
+        savestate.load_state(self, data)
+        self.apu.reset(self.cycles)
+
+    def enable_audio(self, sample_rate=44100):
+        """ Renders audio into self.apu.output at the end of every run """
+        self.apu.enable(sample_rate)
+
+    def disable_audio(self):
+        self.apu.disable()
+
+    def step(self):
+        """ Executes a single instruction and returns its cycles at the base clock """
+        if self.accurate:
+            return self._timed_step()
+        cycles = self.cpu.step()
+        self.timer.step(cycles)
+        cycles >>= self.mmu.double_speed
+        self.ppu.step(cycles)
+        self.cycles += cycles
+        return cycles
+
+    def run_frame(self):
+        self._run_to((self.cycles // CYCLES_PER_FRAME + 1) * CYCLES_PER_FRAME)
+
+    def run_frames(self, n):
+        for _ in range(n):
+            self.run_frame()
+
+    def set_buttons(self, buttons):
+        """ Holds the buttons of a joypad byte (see joypad.py) """
+        self.mmu.set_buttons(buttons)
+
+    def run_inputs(self, inputs, frames):
+        """ Runs frames frames driven by an input script, one joypad byte
+        per frame from power on. Buttons only change where the script does,
+        once per run of equal bytes; the frames go through run_frame() like
+        any others, so hooks on it (instrumentation) see every one. """
+        for _, count, buttons in joypad.runs(inputs, self.frame, self.frame + frames):
+            self.mmu.set_buttons(buttons)
+            self.run_frames(count)
+
+    def run_until(self, cycle=None, pc=None, predicate=None, max_cycles=None):
+        """ Runs until the cycle count is reached, the CPU is about to execute
+        pc, or predicate(emulator) returns true. Returns False if max_cycles
+        elapsed first. """
+        if cycle is None and pc is None and predicate is None:
+            raise ValueError("run_until needs a cycle, pc or predicate")
+
+        cpu = self.cpu
+        deadline = None if max_cycles is None else self.cycles + max_cycles
+        if pc is None and predicate is None:
+            if deadline is not None and deadline < cycle:
+                self._run_to(deadline)
+                return False
+            self._run_to(cycle)
+            return True
+
+        stops = [stop for stop in (cycle, deadline) if stop is not None]
+        if stops:
+            self._target = min(stops)
+            cpu.block_budget = self._budget
+        try:
+            while True:
+                if pc is not None and cpu.pc == pc:
+                    return True
+                if predicate is not None and predicate(self):
+                    return True
+                if cycle is not None and self.cycles >= cycle:
+                    return True
+                if deadline is not None and self.cycles >= deadline:
+                    return False
+                self.step()
+        finally:
+            cpu.block_budget = None
+
+    def _run_to(self, target):
+        self._run_cpu_to(target)
+        if self.apu.enabled:
+            self.apu.render(self.cycles)
+
+    def _budget(self):
+        # CPU cycles left until the run in progress stops
+        return (self._target - self.cycles) << self.mmu.double_speed
+
+    def _run_cpu_to(self, target):
+        if self.accurate:
+            timed_step = self._timed_step
+            while self.cycles < target:
+                timed_step()
+            return
+        self._target = target
+        self.cpu.block_budget = self._budget
+        try:
+            self._run_fast_to(target)
+        finally:
+            self.cpu.block_budget = None
+
+    def _run_fast_to(self, target):
+        cpu_step = self.cpu.step
+        ppu_step = self.ppu.step
+        timer_step = self.timer.step
+        mmu = self.mmu
+        if mmu.cgb:
+            # the timer runs at the CPU clock, the PPU at the base clock
+            while self.cycles < target:
+                cycles = cpu_step()
+                timer_step(cycles)
+                cycles >>= mmu.double_speed
+                ppu_step(cycles)
+                self.cycles += cycles
+            return
+        while self.cycles < target:
+            cycles = cpu_step()
+            ppu_step(cycles)
+            timer_step(cycles)
+            self.cycles += cycles
+
+    # --- accurate timing ---
+    def _tick(self, cycles):
+        self.timer.step(cycles)
+        self._elapsed += cycles
+        cycles >>= self.mmu.double_speed
+        self.ppu.step(cycles)
+        self.cycles += cycles
+
+    def _timed_step(self):
+        # memory accesses and internal M-cycles tick as the instruction runs,
+        # whatever is left of its cycles comes after the last access
+        self._elapsed = 0
+        cycles = self.cpu.step()
+        if cycles > self._elapsed:
+            self._tick(cycles - self._elapsed)
+        return cycles >> self.mmu.double_speed
+
+    def _timing_hooks(self):
+        """ MMU wrappers ticking one M-cycle before each memory access """
+        tick = self._tick
+
+        def read_byte(inner):
+            def read(mmu, address):
+                tick(4)
+                return inner(mmu, address)
+            return read
+
+        def write_byte(inner):
+            def write(mmu, address, value):
+                tick(4)
+                inner(mmu, address, value)
+            return write
+
+        def internal(inner):
+            def idle(mmu, cycles):
+                tick(cycles)
+            return idle
+
+        return {'read_byte': read_byte, 'write_byte': write_byte, 'tick': internal}
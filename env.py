@@ -0,0 +1,192 @@
+import multiprocessing
+from multiprocessing import shared_memory
+
+from emulator import Emulator
+
+HEIGHT = 144
+WIDTH = 160
+
+
+def _read_rom(rom):
+    if isinstance(rom, (bytes, bytearray, memoryview)):
+        return bytes(rom)
+    with open(rom, 'rb') as f:
+        return f.read()
+
+
+class Env:
+    """ Gym-style wrapper around one headless core. Actions are joypad bytes
+    (see joypad.py), or indices into actions when that list is given, and
+    observations are the 144x160 uint8 framebuffer (a numpy array, so this
+    needs numpy; see requirements.txt).
+
+    reward(emulator) and done(emulator) score the machine after each step;
+    without them every step gives 0 and only max_frames ends an episode.
+    Every reset() goes back to state, a savestate blob, or to power on.
+    VectorEnv passes these to worker processes, so use module level
+    functions rather than lambdas there. """
+
+    def __init__(self, rom, state=None, frames_per_step=1, reward=None, done=None,
+                 max_frames=None, actions=None):
+        self.emulator = Emulator(_read_rom(rom))
+        self.start = bytes(state) if state is not None else bytes(self.emulator.save_state())
+        self.frames_per_step = frames_per_step
+        self.reward = reward
+        self.done = done
+        self.max_frames = max_frames
+        self.actions = actions
+        self.start_frame = 0
+        self.emulator.load_state(self.start)
+
+    def reset(self):
+        """ Returns (observation, info) at the start state """
+        self.emulator.load_state(self.start)
+        self.start_frame = self.emulator.frame
+        return self.observe(), {'frame': self.start_frame}
+
+    def step(self, action, frames=None):
+        """ Holds action for frames frames (frames_per_step by default) and
+        returns (observation, reward, terminated, truncated, info) """
+        self._run(action, frames)
+        return (self.observe(),) + self._score()
+
+    def observe(self, out=None):
+        """ The framebuffer as a (144, 160) uint8 array, copied into out if given """
+        import numpy as np
+        screen = np.frombuffer(self.emulator.ppu.framebuffer, dtype=np.uint8).reshape(HEIGHT, WIDTH)
+        if out is None:
+            return screen.copy()
+        out[:] = screen
+        return out
+
+    def _run(self, action, frames):
+        emulator = self.emulator
+        emulator.set_buttons(self.actions[action] if self.actions is not None else action)
+        emulator.run_frames(self.frames_per_step if frames is None else frames)
+
+    def _score(self):
+        emulator = self.emulator
+        reward = float(self.reward(emulator)) if self.reward is not None else 0.0
+        terminated = bool(self.done(emulator)) if self.done is not None else False
+        truncated = (self.max_frames is not None
+                     and emulator.frame - self.start_frame >= self.max_frames)
+        return reward, terminated, truncated, {'frame': emulator.frame}
+
+
+def _worker(connection, name, first, count, total, env_kwargs):
+    import numpy as np
+    memory = shared_memory.SharedMemory(name=name)
+    observations = np.ndarray((total, HEIGHT, WIDTH), dtype=np.uint8, buffer=memory.buf)
+    envs = [Env(**env_kwargs) for _ in range(count)]
+    try:
+        while True:
+            command, data = connection.recv()
+            if command == 'step':
+                actions, frames = data
+                results = []
+                for i, (env, action) in enumerate(zip(envs, actions)):
+                    env._run(action, frames)
+                    reward, terminated, truncated, info = env._score()
+                    if terminated or truncated:
+                        # like gym's vector envs: the observation after a
+                        # finished episode is already the next one's first
+                        env.reset()
+                        info = {'frame': env.emulator.frame, 'final_info': info}
+                    env.observe(observations[first + i])
+                    results.append((reward, terminated, truncated, info))
+                connection.send(results)
+            elif command == 'reset':
+                for i, env in enumerate(envs):
+                    env.reset()
+                    env.observe(observations[first + i])
+                connection.send(None)
+            elif command == 'close':
+                break
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        del observations
+        memory.close()
+
+
+class VectorEnv:
+    """ n Env instances spread over worker processes. Observations are
+    written by the workers straight into one shared (n, 144, 160) uint8
+    array, so a batch reaches the learner without pickling frames, and a
+    step is one message to and one reply from each worker.
+
+    The observation array returned by reset() and step() is that shared
+    buffer: it is overwritten by the next step, copy it to keep it.
+    Finished episodes reset automatically. """
+
+    def __init__(self, rom, n, workers=None, **env_kwargs):
+        import numpy as np
+        self.n = n
+        workers = min(n, workers or multiprocessing.cpu_count())
+        env_kwargs['rom'] = _read_rom(rom)
+
+        self.memory = shared_memory.SharedMemory(create=True, size=n * HEIGHT * WIDTH)
+        self.observations = np.ndarray((n, HEIGHT, WIDTH), dtype=np.uint8, buffer=self.memory.buf)
+        self.observations[:] = 0
+
+        # contiguous slices of the batch per worker
+        self.slices = []
+        self.connections = []
+        self.processes = []
+        for w in range(workers):
+            first = n * w // workers
+            count = n * (w + 1) // workers - first
+            parent, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=_worker, name=f"env worker {w}", daemon=True,
+                args=(child, self.memory.name, first, count, n, env_kwargs))
+            process.start()
+            child.close()
+            self.slices.append((first, count))
+            self.connections.append(parent)
+            self.processes.append(process)
+        self.closed = False
+
+    def reset(self):
+        """ Returns (observations, infos) """
+        for connection in self.connections:
+            connection.send(('reset', None))
+        for connection in self.connections:
+            connection.recv()
+        return self.observations, [{} for _ in range(self.n)]
+
+    def step(self, actions, frames=None):
+        """ One action per env. Returns (observations, rewards, terminated,
+        truncated, infos), the middle three as arrays. """
+        import numpy as np
+        for connection, (first, count) in zip(self.connections, self.slices):
+            connection.send(('step', (list(actions[first:first + count]), frames)))
+        results = []
+        for connection in self.connections:
+            results.extend(connection.recv())
+        rewards, terminated, truncated, infos = zip(*results)
+        return (self.observations, np.array(rewards, dtype=np.float32),
+                np.array(terminated), np.array(truncated), list(infos))
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        for connection in self.connections:
+            try:
+                connection.send(('close', None))
+            except (BrokenPipeError, OSError):
+                pass
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        del self.observations
+        self.memory.close()
+        self.memory.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
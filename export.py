@@ -0,0 +1,229 @@
+import argparse
+import os
+import queue
+import struct
+import sys
+import threading
+import wave
+import zlib
+
+from emulator import CLOCK_SPEED, CYCLES_PER_FRAME, Emulator
+import joypad
+
+WIDTH = 160
+HEIGHT = 144
+
+
+class ThreadedWriter:
+    """ Runs a sink's write() and close() on a worker thread. The emulation
+    thread only queues snapshots; put() waits for the worker only once
+    depth items are already queued, which bounds the memory an export can
+    use when the disk falls behind. """
+
+    def __init__(self, sink, depth=64):
+        self.sink = sink
+        self.queue = queue.Queue(maxsize=depth)
+        self.error = None
+        self.thread = threading.Thread(target=self._run, name=f"export {type(sink).__name__}",
+                                       daemon=True)
+        self.thread.start()
+
+    def put(self, *item):
+        if self.error is not None:
+            raise self.error
+        self.queue.put(item)
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def _run(self):
+        try:
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    break
+                self.sink.write(*item)
+        except Exception as e:
+            self.error = e
+            # keep draining so put() and close() never wait on a dead worker
+            while self.queue.get() is not None:
+                pass
+        finally:
+            try:
+                self.sink.close()
+            except Exception as e:
+                self.error = self.error or e
+
+
+def _tables(palette, channels):
+    """ bytes.translate() tables from framebuffer values to each channel """
+    colors = list(palette) + [(0, 0, 0)] * (256 - len(palette))
+    return [bytes(channel(*color) for color in colors) for channel in channels]
+
+
+# --- video sinks: write(frame, palette) with frame the framebuffer bytes ---
+class RawVideo:
+    """ Headerless RGB24 frames, one after the other """
+
+    def __init__(self, path):
+        self.file = open(path, 'wb')
+        self.palette = None
+        self.tables = None
+
+    def write(self, frame, palette):
+        if palette != self.palette:
+            self.palette = palette
+            self.tables = _tables(palette, (lambda r, g, b: r, lambda r, g, b: g, lambda r, g, b: b))
+        rgb = bytearray(len(frame) * 3)
+        for i, table in enumerate(self.tables):
+            rgb[i::3] = frame.translate(table)
+        self.file.write(rgb)
+
+    def close(self):
+        self.file.close()
+
+
+class Y4MVideo:
+    """ YUV4MPEG2 stream in 4:4:4, which players and ffmpeg read directly """
+
+    # BT.601 studio swing
+    CHANNELS = (
+        lambda r, g, b: round(16 + (65.481 * r + 128.553 * g + 24.966 * b) / 255),
+        lambda r, g, b: round(128 + (-37.797 * r - 74.203 * g + 112.0 * b) / 255),
+        lambda r, g, b: round(128 + (112.0 * r - 93.786 * g - 18.214 * b) / 255),
+    )
+
+    def __init__(self, path):
+        self.file = open(path, 'wb')
+        self.file.write(f"YUV4MPEG2 W{WIDTH} H{HEIGHT} F{CLOCK_SPEED}:{CYCLES_PER_FRAME} "
+                        f"Ip A1:1 C444\n".encode('ascii'))
+        self.palette = None
+        self.tables = None
+
+    def write(self, frame, palette):
+        if palette != self.palette:
+            self.palette = palette
+            self.tables = _tables(palette, self.CHANNELS)
+        self.file.write(b'FRAME\n')
+        for table in self.tables:
+            self.file.write(frame.translate(table))
+
+    def close(self):
+        self.file.close()
+
+
+class PNGFrames:
+    """ One palette PNG per frame in a directory, frame_000000.png onwards.
+    The framebuffer values are the PNG's pixel indices, so encoding is just
+    zlib on the rows. """
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.count = 0
+
+    @staticmethod
+    def _chunk(kind, data):
+        return (struct.pack('>I', len(data)) + kind + data
+                + struct.pack('>I', zlib.crc32(kind + data)))
+
+    def write(self, frame, palette):
+        rows = b''.join(b'\x00' + frame[y * WIDTH:(y + 1) * WIDTH] for y in range(HEIGHT))
+        png = (b'\x89PNG\r\n\x1a\n'
+               + self._chunk(b'IHDR', struct.pack('>IIBBBBB', WIDTH, HEIGHT, 8, 3, 0, 0, 0))
+               + self._chunk(b'PLTE', bytes(c for color in palette for c in color))
+               + self._chunk(b'IDAT', zlib.compress(rows, 6))
+               + self._chunk(b'IEND', b''))
+        path = os.path.join(self.directory, f"frame_{self.count:06d}.png")
+        with open(path, 'wb') as f:
+            f.write(png)
+        self.count += 1
+
+    def close(self):
+        pass
+
+
+# --- audio sink: write(samples) with samples int16 stereo frames as bytes ---
+class WAVAudio:
+    def __init__(self, path, sample_rate):
+        self.file = wave.open(path, 'wb')
+        self.file.setnchannels(2)
+        self.file.setsampwidth(2)
+        self.file.setframerate(sample_rate)
+
+    def write(self, samples):
+        self.file.writeframesraw(samples)
+
+    def close(self):
+        self.file.close() # patches the header with the final length
+
+
+VIDEO_FORMATS = {'rgb': RawVideo, 'y4m': Y4MVideo, 'png': PNGFrames}
+
+
+def video_format(path):
+    """ Format from the file extension: .y4m, .rgb/.raw, otherwise a directory of PNGs """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.y4m':
+        return 'y4m'
+    if extension in ('.rgb', '.raw'):
+        return 'rgb'
+    return 'png'
+
+
+def export(emulator, frames, video=None, audio=None, inputs=b'', video_format_name=None,
+           sample_rate=44100, depth=64):
+    """ Runs frames frames as fast as possible, streaming every frame to the
+    video path and the sound to the audio WAV path. Conversion, encoding
+    and disk writes happen on one worker thread per output. """
+    writers = []
+    video_writer = audio_writer = None
+    if video is not None:
+        sink = VIDEO_FORMATS[video_format_name or video_format(video)](video)
+        video_writer = ThreadedWriter(sink, depth)
+        writers.append(video_writer)
+    if audio is not None:
+        emulator.enable_audio(sample_rate)
+        audio_writer = ThreadedWriter(WAVAudio(audio, sample_rate), depth)
+        writers.append(audio_writer)
+
+    ppu = emulator.ppu
+    try:
+        for _ in range(frames):
+            emulator.run_inputs(inputs, 1)
+            if video_writer is not None:
+                video_writer.put(bytes(ppu.framebuffer), tuple(ppu.palette()))
+            if audio_writer is not None:
+                audio_writer.put(emulator.apu.output.read().tobytes())
+    finally:
+        for writer in writers:
+            writer.close()
+        if audio is not None:
+            emulator.disable_audio()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render a ROM's video and audio to files, uncapped")
+    parser.add_argument('rom')
+    parser.add_argument('--frames', type=int, default=600)
+    parser.add_argument('--video', help="output .y4m, .rgb/.raw, or a directory for PNG frames")
+    parser.add_argument('--video-format', choices=sorted(VIDEO_FORMATS), default=None)
+    parser.add_argument('--audio', help="output .wav (needs numpy)")
+    parser.add_argument('--sample-rate', type=int, default=44100)
+    parser.add_argument('--inputs', help="input script (.txt or run-length encoded, see joypad.py)")
+    args = parser.parse_args(argv)
+
+    if args.video is None and args.audio is None:
+        parser.error("nothing to export, give --video and/or --audio")
+    inputs = joypad.load(args.inputs) if args.inputs else b''
+    export(Emulator(args.rom), args.frames, args.video, args.audio, inputs,
+           args.video_format, args.sample_rate)
+    print(f"Exported {args.frames} frames")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
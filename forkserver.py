@@ -0,0 +1,129 @@
+import gc
+import os
+import pickle
+import struct
+import traceback
+
+from emulator import Emulator
+
+HEADER = struct.Struct('<?Q')
+
+
+class Clone:
+    """ A forked branch. result() waits for the child and returns what its
+    branch function returned, or raises if the branch raised. """
+
+    def __init__(self, pid, fd):
+        self.pid = pid
+        self.fd = fd
+        self.done = False
+        self.value = None
+        self.error = None
+
+    def result(self):
+        if not self.done:
+            with os.fdopen(self.fd, 'rb') as pipe:
+                header = pipe.read(HEADER.size)
+                ok, size = HEADER.unpack(header) if len(header) == HEADER.size else (False, 0)
+                data = pipe.read(size)
+            _, status = os.waitpid(self.pid, 0)
+            self.done = True
+            if len(header) != HEADER.size or len(data) != size:
+                self.error = RuntimeError(f"clone {self.pid} died without a result "
+                                          f"(wait status {status})")
+            elif ok:
+                self.value = pickle.loads(data)
+            else:
+                self.error = RuntimeError(f"clone {self.pid} failed:\n{data.decode()}")
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class ForkServer:
+    """ Holds one loaded core at a state and branches it with os.fork().
+    Children start from the parent's memory copy-on-write, so a clone costs
+    the same whatever the state size and only the pages a branch writes are
+    ever copied; the ROM is never written and stays shared by every clone.
+    Results come back pickled over a pipe. POSIX only.
+
+    branch(emulator, *args) runs in the child against its private copy of
+    the core, so it can run frames, set buttons or load states freely.
+
+    The objects alive when the server is made (and at each map()) are moved
+    into the collector's permanent generation, so a child's collections
+    don't touch, and so copy, every object page of the parent. The freeze is
+    process-wide: until close() (or the end of a with block) gives them back,
+    none of the parent's objects from before then are ever collected. """
+
+    def __init__(self, rom, state=None, **emulator_kwargs):
+        if not hasattr(os, 'fork'):
+            raise RuntimeError("fork server needs os.fork(), which this platform lacks")
+        self.emulator = rom if isinstance(rom, Emulator) else Emulator(rom, **emulator_kwargs)
+        if state is not None:
+            self.emulator.load_state(state)
+        self.closed = False
+        self._freeze()
+
+    def _freeze(self):
+        gc.collect()
+        gc.freeze()
+
+    def clone(self, branch, *args):
+        """ Forks a child running branch(emulator, *args), returns its Clone """
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            status = 0
+            try:
+                try:
+                    ok, data = True, pickle.dumps(branch(self.emulator, *args), pickle.HIGHEST_PROTOCOL)
+                except BaseException:
+                    ok, data, status = False, traceback.format_exc().encode(), 1
+                with os.fdopen(write_fd, 'wb') as pipe:
+                    pipe.write(HEADER.pack(ok, len(data)))
+                    pipe.write(data)
+            finally:
+                # skip the parent's atexit handlers and buffered files
+                os._exit(status)
+        os.close(write_fd)
+        return Clone(pid, read_fd)
+
+    def map(self, branch, items, jobs=None):
+        """ branch(emulator, item) for every item, at most jobs children at
+        once (one per CPU by default). Returns the results in order. """
+        jobs = jobs or os.cpu_count() or 1
+        items = list(items)
+        self._freeze()
+        running = []
+        results = []
+        try:
+            for item in items:
+                if len(running) >= jobs:
+                    results.append(running.pop(0).result())
+                running.append(self.clone(branch, item))
+            while running:
+                results.append(running.pop(0).result())
+        finally:
+            # reap the rest if a branch failed
+            for clone in running:
+                try:
+                    clone.result()
+                except RuntimeError:
+                    pass
+        return results
+
+    def close(self):
+        """ Hands the frozen objects back to the collector. Clones still
+        running are unaffected. """
+        if self.closed:
+            return
+        self.closed = True
+        gc.unfreeze()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,28 @@
+class FrameSlot:
+    """ Hands the newest completed frame from the emulation thread to the
+    presenter without locks. Each frame is an immutable bytes snapshot, so
+    publishing is a single reference store (atomic under the GIL) and a
+    presenter that falls behind simply skips to the latest frame. """
+
+    def __init__(self):
+        self._latest = None
+        self.published = 0
+        self.presented = 0
+
+    def publish(self, frame):
+        self.published += 1
+        self._latest = (self.published, frame)
+
+    def take(self, last_sequence):
+        """ Returns (sequence, frame) if a frame newer than last_sequence was
+        published, otherwise None """
+        latest = self._latest
+        if latest is None or latest[0] == last_sequence:
+            return None
+        self.presented += 1
+        return latest
+
+    @property
+    def dropped(self):
+        """ Frames that were overwritten before the presenter picked them up """
+        return self.published - self.presented
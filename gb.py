@@ -1,52 +1,207 @@
-import pygame
-from cpu import CPU
-from mmu import MMU
-from ppu import PPU
+import argparse
+import threading
+import time
+
+from emulator import Emulator
+from framesync import FrameSlot
+from instrument import Instrumentation
+import joypad
+from pacing import Pacer
+from rewind import Rewind
+
+# frames handed to pygame.mixer at a time, about 23 ms at 44.1 kHz
+AUDIO_CHUNK = 1024
+
 
 class Gameboy:
-    def __init__(self):
+    """ pygame window on top of the headless Emulator; pygame is only imported here """
+
+    def __init__(self, rom_path='roms/cpu_instrs.gb', speed=1.0, rewind_seconds=0, rewind_bytes=None, stats=False,
+                 audio=False, sample_rate=44100):
+        import pygame
         pygame.init()
         self.screen_width = 160
         self.screen_height = 144
         self.screen = pygame.display.set_mode((self.screen_width, self.screen_height))
         pygame.display.set_caption("Gameboy Emulator")
-        self.clock = pygame.time.Clock()
         self.running = True
 
-        self.mmu = MMU()
-        self.cpu = CPU(self.mmu)
-        self.ppu = PPU(self.mmu, self.cpu)
+        self.rom_path = rom_path
+        self.emulator = Emulator()
+        self.mmu = self.emulator.mmu
+        self.cpu = self.emulator.cpu
+        self.ppu = self.emulator.ppu
+
+        # newest finished frame, handed from the emulation thread to the window
+        self.frames = FrameSlot()
+
+        # speed=1.0 is the hardware rate, None runs uncapped
+        self.pacer = Pacer(speed)
+
+        # hold backspace to rewind
+        self.rewind = None
+        if rewind_seconds:
+            self.rewind = Rewind(self.emulator, rewind_seconds, max_bytes=rewind_bytes)
+        self.rewinding = False
+
+        # joypad byte of the keys held in the window, applied by the
+        # emulation thread between frames
+        self.buttons = 0
+        # colors of the last presented frame
+        self.palette = None
+        self.keys = {pygame.K_x: joypad.A, pygame.K_z: joypad.B,
+                     pygame.K_RSHIFT: joypad.SELECT,
+                     pygame.K_RETURN: joypad.START,
+                     pygame.K_RIGHT: joypad.RIGHT, pygame.K_LEFT: joypad.LEFT,
+                     pygame.K_UP: joypad.UP, pygame.K_DOWN: joypad.DOWN}
+
+        # per-subsystem timings, logged once a second
+        self.instrumentation = Instrumentation(self.emulator, frontend=self, log_interval=1.0)
+        if self.rewind is not None:
+            rewind = self.rewind
+            self.instrumentation.gauges['rewind'] = (
+                lambda: f"{rewind.memory_usage / (1024 * 1024):.1f}MB for {rewind.seconds:.1f}s")
+        if stats:
+            self.instrumentation.enable()
+
+        # the APU renders into a ring buffer, the window loop keeps one chunk
+        # of it queued on a mixer channel
+        self.audio_channel = None
+        if audio:
+            pygame.mixer.init(frequency=sample_rate, size=-16, channels=2, buffer=AUDIO_CHUNK)
+            self.emulator.enable_audio(sample_rate)
+            self.audio_channel = pygame.mixer.Channel(0)
 
     def run(self):
-        self.mmu.load_rom('roms/cpu_instrs.gb')
+        import pygame
+        self.emulator.load_rom(self.rom_path)
         #self.mmu.load_rom('roms/tetris.gb')
 
-        
-        # Gameboy clock speed is 4.194304 MHz. At 60 FPS, this is ~70,000 cycles per frame.
-        cycles_per_frame = 4194304 // 60
+        # pygame wants its window on the main thread, so emulation moves to a worker
+        worker = threading.Thread(target=self._emulate, name="emulation", daemon=True)
+        worker.start()
 
+        sequence = 0
+        presented = bytes(self.screen_width * self.screen_height)
+        first = True
         while self.running:
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
                     self.running = False
+                elif event.type in (pygame.KEYDOWN, pygame.KEYUP) and event.key == pygame.K_BACKSPACE:
+                    self.rewinding = event.type == pygame.KEYDOWN
+                elif event.type in (pygame.KEYDOWN, pygame.KEYUP) and event.key in self.keys:
+                    if event.type == pygame.KEYDOWN:
+                        self.buttons |= self.keys[event.key]
+                    else:
+                        self.buttons &= ~self.keys[event.key]
 
-            cycles_this_frame = 0
-            while cycles_this_frame < cycles_per_frame:
-                cycles = self.cpu.step()
-                self.ppu.step(cycles)
-                cycles_this_frame += cycles
+            if self.audio_channel is not None:
+                self._feed_audio()
 
-            self.draw_framebuffer()
-            pygame.display.flip()
-            self.clock.tick(60)
+            latest = self.frames.take(sequence)
+            if latest is None:
+                time.sleep(0.001)
+                continue
+            sequence, frame = latest
+            self.draw_framebuffer(frame, presented, first)
+            presented = frame
+            first = False
 
+        worker.join()
         pygame.quit()
 
-    def draw_framebuffer(self):
-        for y, row in enumerate(self.ppu.framebuffer):
-            for x, color in enumerate(row):
-                self.screen.set_at((x, y), color)
+    def _emulate(self):
+        emulator = self.emulator
+        ppu = self.ppu
+        rewind = self.rewind
+        self.pacer.reset()
+        try:
+            while self.running:
+                if rewind is not None and self.rewinding:
+                    rewind.step_back()
+                else:
+                    if self.buttons != self.mmu.buttons:
+                        emulator.set_buttons(self.buttons)
+                    emulator.run_frame()
+                    if rewind is not None:
+                        rewind.frame_done()
+                # identical frames are not published at all
+                if ppu.take_dirty_lines():
+                    self.frames.publish(bytes(ppu.framebuffer))
+                self.pacer.frame_done()
+        finally:
+            self.running = False
+
+    def _feed_audio(self):
+        import pygame
+        output = self.emulator.apu.output
+        if self.audio_channel.get_queue() is None and output.available() >= AUDIO_CHUNK:
+            frames = output.read(AUDIO_CHUNK)
+            self.audio_channel.queue(pygame.sndarray.make_sound(frames))
+
+    def draw_framebuffer(self, frame, previous, full=False):
+        import pygame
+        width = self.screen_width
+
+        # CGB palettes can change without the framebuffer changing
+        palette = self.ppu.palette()
+        if palette != self.palette:
+            self.palette = palette
+            full = True
+
+        # compare against the last presented frame rather than the PPU's dirty
+        # flags, so scanlines changed in dropped frames are not lost
+        if full:
+            lines = list(range(self.screen_height))
+        else:
+            lines = [y for y in range(self.screen_height)
+                     if frame[y * width:(y + 1) * width] != previous[y * width:(y + 1) * width]]
+        if not lines:
+            return
+
+        # merge runs of adjacent dirty scanlines into one rect each
+        rects = []
+        start = prev = lines[0]
+        for y in lines[1:]:
+            if y != prev + 1:
+                rects.append(pygame.Rect(0, start, width, prev - start + 1))
+                start = y
+            prev = y
+        rects.append(pygame.Rect(0, start, width, prev - start + 1))
+
+        surface = pygame.image.frombuffer(frame, (width, self.screen_height), 'P')
+        surface.set_palette(palette)
+        for rect in rects:
+            self.screen.blit(surface, rect, rect)
+        pygame.display.update(rects)
+
+def positive_float(text):
+    value = float(text)
+    if value <= 0:
+        raise argparse.ArgumentTypeError(f"must be greater than 0, got {text}")
+    return value
 
 if __name__ == "__main__":
-    gb = Gameboy()
-    gb.run()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Gameboy Emulator")
+    parser.add_argument('rom', nargs='?', default='roms/cpu_instrs.gb')
+    pacing = parser.add_mutually_exclusive_group()
+    pacing.add_argument('--speed', type=positive_float, default=1.0,
+                        help="multiple of the hardware frame rate (default 1.0)")
+    pacing.add_argument('--uncapped', action='store_true',
+                        help="run as fast as possible")
+    parser.add_argument('--rewind', type=float, default=0, metavar='SECONDS',
+                        help="keep this much rewind history (hold backspace to rewind)")
+    parser.add_argument('--rewind-mb', type=float, default=None,
+                        help="memory budget for the rewind history")
+    parser.add_argument('--audio', action='store_true',
+                        help="play sound (needs numpy)")
+    parser.add_argument('--stats', action='store_true',
+                        help="log per-subsystem call counts and timings every second")
+    args = parser.parse_args()
+
+    rewind_bytes = int(args.rewind_mb * 1024 * 1024) if args.rewind_mb else None
+    gb = Gameboy(args.rom, speed=None if args.uncapped else args.speed,
+                 rewind_seconds=args.rewind, rewind_bytes=rewind_bytes, stats=args.stats,
+                 audio=args.audio)
+    gb.run()
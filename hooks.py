@@ -0,0 +1,43 @@
+def install(obj, owner, wrappers):
+    """ Swaps wrapped versions of obj's methods in without touching its class
+    or the fast path of other instances.
+
+    wrappers maps a method name to factory(inner) -> function(self, ...),
+    where inner is the implementation being wrapped. obj is moved to a
+    generated subclass holding the wrappers, so when nothing is installed
+    there is no indirection at all. Several owners can hook the same object
+    and be removed in any order; later owners wrap earlier ones. """
+    base, layers = _layers(obj)
+    layers = [layer for layer in layers if layer[0] is not owner]
+    layers.append((owner, wrappers))
+    _rebuild(obj, base, layers)
+
+
+def remove(obj, owner):
+    """ Removes the wrappers installed by owner """
+    base, layers = _layers(obj)
+    _rebuild(obj, base, [layer for layer in layers if layer[0] is not owner])
+
+
+def installed(obj, owner):
+    return any(layer[0] is owner for layer in _layers(obj)[1])
+
+
+def _layers(obj):
+    cls = type(obj)
+    if '_hook_base' in cls.__dict__:
+        return cls._hook_base, list(cls._hook_layers)
+    return cls, []
+
+
+def _rebuild(obj, base, layers):
+    if not layers:
+        obj.__class__ = base
+        return
+    namespace = {'__slots__': (), '__module__': base.__module__,
+                 '_hook_base': base, '_hook_layers': tuple(layers)}
+    for _, wrappers in layers:
+        for name, factory in wrappers.items():
+            inner = namespace.get(name) or getattr(base, name)
+            namespace[name] = factory(inner)
+    obj.__class__ = type(base.__name__, (base,), namespace)
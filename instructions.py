@@ -0,0 +1,594 @@
+import linecache
+import re
+
+# The SM83 instruction set as data. Each entry is
+#   (mnemonic, cycles, cycles when a condition is taken, flags Z N H C)
+# where a flag is '-' unchanged, '0' or '1' reset or set, or its own letter
+# when it is computed from the result.
+#
+# Operand placeholders: d8 immediate byte, d16/a16 immediate word, r8 signed
+# jump offset, a8 high page address (0xFF00 + byte).
+#
+# The CPU's op_0x.. and cb_0x.. handlers are generated from these tables
+# when the module is imported (see build_handlers), and the disassembler
+# reads its mnemonics from them.
+
+REGISTERS = ['B', 'C', 'D', 'E', 'H', 'L', '(HL)', 'A']
+ALU = ['ADD A,', 'ADC A,', 'SUB ', 'SBC A,', 'AND ', 'XOR ', 'OR ', 'CP ']
+ALU_FLAGS = ['Z0HC', 'Z0HC', 'Z1HC', 'Z1HC', 'Z010', 'Z000', 'Z000', 'Z1HC']
+CB_SHIFTS = ['RLC', 'RRC', 'RL', 'RR', 'SLA', 'SRA', 'SWAP', 'SRL']
+
+INSTRUCTIONS = [
+    ('NOP', 4, None, '----'),
+    ('LD BC,d16', 12, None, '----'),
+    ('LD (BC),A', 8, None, '----'),
+    ('INC BC', 8, None, '----'),
+    ('INC B', 4, None, 'Z0H-'),
+    ('DEC B', 4, None, 'Z1H-'),
+    ('LD B,d8', 8, None, '----'),
+    ('RLCA', 4, None, '000C'),
+    ('LD (a16),SP', 20, None, '----'),
+    ('ADD HL,BC', 8, None, '-0HC'),
+    ('LD A,(BC)', 8, None, '----'),
+    ('DEC BC', 8, None, '----'),
+    ('INC C', 4, None, 'Z0H-'),
+    ('DEC C', 4, None, 'Z1H-'),
+    ('LD C,d8', 8, None, '----'),
+    ('RRCA', 4, None, '000C'),
+
+    ('STOP d8', 4, None, '----'),
+    ('LD DE,d16', 12, None, '----'),
+    ('LD (DE),A', 8, None, '----'),
+    ('INC DE', 8, None, '----'),
+    ('INC D', 4, None, 'Z0H-'),
+    ('DEC D', 4, None, 'Z1H-'),
+    ('LD D,d8', 8, None, '----'),
+    ('RLA', 4, None, '000C'),
+    ('JR r8', 12, None, '----'),
+    ('ADD HL,DE', 8, None, '-0HC'),
+    ('LD A,(DE)', 8, None, '----'),
+    ('DEC DE', 8, None, '----'),
+    ('INC E', 4, None, 'Z0H-'),
+    ('DEC E', 4, None, 'Z1H-'),
+    ('LD E,d8', 8, None, '----'),
+    ('RRA', 4, None, '000C'),
+
+    ('JR NZ,r8', 8, 12, '----'),
+    ('LD HL,d16', 12, None, '----'),
+    ('LD (HL+),A', 8, None, '----'),
+    ('INC HL', 8, None, '----'),
+    ('INC H', 4, None, 'Z0H-'),
+    ('DEC H', 4, None, 'Z1H-'),
+    ('LD H,d8', 8, None, '----'),
+    ('DAA', 4, None, 'Z-0C'),
+    ('JR Z,r8', 8, 12, '----'),
+    ('ADD HL,HL', 8, None, '-0HC'),
+    ('LD A,(HL+)', 8, None, '----'),
+    ('DEC HL', 8, None, '----'),
+    ('INC L', 4, None, 'Z0H-'),
+    ('DEC L', 4, None, 'Z1H-'),
+    ('LD L,d8', 8, None, '----'),
+    ('CPL', 4, None, '-11-'),
+
+    ('JR NC,r8', 8, 12, '----'),
+    ('LD SP,d16', 12, None, '----'),
+    ('LD (HL-),A', 8, None, '----'),
+    ('INC SP', 8, None, '----'),
+    ('INC (HL)', 12, None, 'Z0H-'),
+    ('DEC (HL)', 12, None, 'Z1H-'),
+    ('LD (HL),d8', 12, None, '----'),
+    ('SCF', 4, None, '-001'),
+    ('JR C,r8', 8, 12, '----'),
+    ('ADD HL,SP', 8, None, '-0HC'),
+    ('LD A,(HL-)', 8, None, '----'),
+    ('DEC SP', 8, None, '----'),
+    ('INC A', 4, None, 'Z0H-'),
+    ('DEC A', 4, None, 'Z1H-'),
+    ('LD A,d8', 8, None, '----'),
+    ('CCF', 4, None, '-00C'),
+]
+INSTRUCTIONS += [('HALT', 4, None, '----') if (dst, src) == (6, 6) else
+                 (f'LD {REGISTERS[dst]},{REGISTERS[src]}', 8 if 6 in (dst, src) else 4, None, '----')
+                 for dst in range(8) for src in range(8)]
+INSTRUCTIONS += [(ALU[op] + REGISTERS[src], 8 if src == 6 else 4, None, ALU_FLAGS[op])
+                 for op in range(8) for src in range(8)]
+INSTRUCTIONS += [
+    ('RET NZ', 8, 20, '----'),
+    ('POP BC', 12, None, '----'),
+    ('JP NZ,a16', 12, 16, '----'),
+    ('JP a16', 16, None, '----'),
+    ('CALL NZ,a16', 12, 24, '----'),
+    ('PUSH BC', 16, None, '----'),
+    ('ADD A,d8', 8, None, 'Z0HC'),
+    ('RST 00H', 16, None, '----'),
+    ('RET Z', 8, 20, '----'),
+    ('RET', 16, None, '----'),
+    ('JP Z,a16', 12, 16, '----'),
+    ('PREFIX CB', 4, None, '----'),
+    ('CALL Z,a16', 12, 24, '----'),
+    ('CALL a16', 24, None, '----'),
+    ('ADC A,d8', 8, None, 'Z0HC'),
+    ('RST 08H', 16, None, '----'),
+
+    ('RET NC', 8, 20, '----'),
+    ('POP DE', 12, None, '----'),
+    ('JP NC,a16', 12, 16, '----'),
+    ('-', 4, None, '----'),
+    ('CALL NC,a16', 12, 24, '----'),
+    ('PUSH DE', 16, None, '----'),
+    ('SUB d8', 8, None, 'Z1HC'),
+    ('RST 10H', 16, None, '----'),
+    ('RET C', 8, 20, '----'),
+    ('RETI', 16, None, '----'),
+    ('JP C,a16', 12, 16, '----'),
+    ('-', 4, None, '----'),
+    ('CALL C,a16', 12, 24, '----'),
+    ('-', 4, None, '----'),
+    ('SBC A,d8', 8, None, 'Z1HC'),
+    ('RST 18H', 16, None, '----'),
+
+    ('LDH (a8),A', 12, None, '----'),
+    ('POP HL', 12, None, '----'),
+    ('LD (C),A', 8, None, '----'),
+    ('-', 4, None, '----'),
+    ('-', 4, None, '----'),
+    ('PUSH HL', 16, None, '----'),
+    ('AND d8', 8, None, 'Z010'),
+    ('RST 20H', 16, None, '----'),
+    ('ADD SP,r8', 16, None, '00HC'),
+    ('JP (HL)', 4, None, '----'),
+    ('LD (a16),A', 16, None, '----'),
+    ('-', 4, None, '----'),
+    ('-', 4, None, '----'),
+    ('-', 4, None, '----'),
+    ('XOR d8', 8, None, 'Z000'),
+    ('RST 28H', 16, None, '----'),
+
+    ('LDH A,(a8)', 12, None, '----'),
+    ('POP AF', 12, None, 'ZNHC'),
+    ('LD A,(C)', 8, None, '----'),
+    ('DI', 4, None, '----'),
+    ('-', 4, None, '----'),
+    ('PUSH AF', 16, None, '----'),
+    ('OR d8', 8, None, 'Z000'),
+    ('RST 30H', 16, None, '----'),
+    ('LD HL,SP+r8', 12, None, '00HC'),
+    ('LD SP,HL', 8, None, '----'),
+    ('LD A,(a16)', 16, None, '----'),
+    ('EI', 4, None, '----'),
+    ('-', 4, None, '----'),
+    ('-', 4, None, '----'),
+    ('CP d8', 8, None, 'Z1HC'),
+    ('RST 38H', 16, None, '----'),
+]
+
+# CB-prefixed instructions, the cycles include the prefix
+CB_INSTRUCTIONS = [(f'{CB_SHIFTS[op]} {REGISTERS[reg]}', 16 if reg == 6 else 8, None,
+                    'Z000' if CB_SHIFTS[op] == 'SWAP' else 'Z00C')
+                   for op in range(8) for reg in range(8)]
+CB_INSTRUCTIONS += [(f'BIT {bit},{REGISTERS[reg]}', 12 if reg == 6 else 8, None, 'Z01-')
+                    for bit in range(8) for reg in range(8)]
+CB_INSTRUCTIONS += [(f'{name} {bit},{REGISTERS[reg]}', 16 if reg == 6 else 8, None, '----')
+                    for name in ('RES', 'SET') for bit in range(8) for reg in range(8)]
+
+MNEMONICS = [instruction[0] for instruction in INSTRUCTIONS]
+CB_MNEMONICS = [instruction[0] for instruction in CB_INSTRUCTIONS]
+
+
+# --- handler generation ---
+#
+# Every handler is specialised for its operands: registers, addressing and
+# flag updates are written out inline, so a handler is one straight run of
+# attribute loads and stores with no helper calls.
+
+FLAG_BITS = {'Z': 0x80, 'N': 0x40, 'H': 0x20, 'C': 0x10}
+PAIRS = {'BC': ('b', 'c'), 'DE': ('d', 'e'), 'HL': ('h', 'l')}
+CONDITIONS = {
+    'NZ': 'not self.f & 0x80',
+    'Z': 'self.f & 0x80',
+    'NC': 'not self.f & 0x10',
+    'C': 'self.f & 0x10',
+}
+
+READ_PC = 'self.mmu.read_byte(self.pc)'
+READ_WORD = 'self.mmu.read_byte(self.pc) | self.mmu.read_byte(self.pc + 1) << 8'
+
+
+class Location:
+    """ An 8-bit operand: setup lines, an expression reading it, a format
+    string writing {} to it, and lines to run afterwards """
+
+    def __init__(self, operand):
+        self.setup = []
+        self.post = []
+        self.write = None
+        if operand in REGISTERS and operand != '(HL)':
+            self.read = f'self.{operand.lower()}'
+            self.write = f'self.{operand.lower()} = {{}}'
+            return
+        if operand == 'd8':
+            self.setup = ['n = ' + READ_PC, 'self.pc += 1']
+            self.read = 'n'
+            return
+
+        if operand in ('(HL)', '(HL+)', '(HL-)'):
+            self.setup = ['address = self.h << 8 | self.l']
+            if operand != '(HL)':
+                sign = operand[3]
+                self.post = [f'hl = (address {sign} 1) & 0xFFFF', 'self.h = hl >> 8', 'self.l = hl & 0xFF']
+        elif operand in ('(BC)', '(DE)'):
+            high, low = PAIRS[operand[1:3]]
+            self.setup = [f'address = self.{high} << 8 | self.{low}']
+        elif operand == '(C)':
+            self.setup = ['address = 0xFF00 | self.c']
+        elif operand == '(a8)':
+            self.setup = ['address = 0xFF00 | ' + READ_PC, 'self.pc += 1']
+        elif operand == '(a16)':
+            self.setup = ['address = ' + READ_WORD, 'self.pc += 2']
+        else:
+            raise ValueError(f"unknown operand {operand}")
+        self.read = 'self.mmu.read_byte(address)'
+        self.write = 'self.mmu.write_byte(address, {})'
+
+
+def _read_pair(name):
+    if name == 'SP':
+        return 'self.sp'
+    if name == 'AF':
+        return 'self.a << 8 | self.f'
+    high, low = PAIRS[name]
+    return f'self.{high} << 8 | self.{low}'
+
+
+def _write_pair(name, value):
+    if name == 'SP':
+        return [f'self.sp = {value}']
+    high, low = PAIRS[name]
+    return [f'self.{high} = {value} >> 8', f'self.{low} = {value} & 0xFF']
+
+
+def _push(value):
+    return ['IDLE',
+            'sp = (self.sp - 1) & 0xFFFF',
+            f'self.mmu.write_byte(sp, {value} >> 8)',
+            'sp = (sp - 1) & 0xFFFF',
+            f'self.mmu.write_byte(sp, {value} & 0xFF)',
+            'self.sp = sp']
+
+
+def _pop(target):
+    return ['sp = self.sp',
+            f'{target} = self.mmu.read_byte(sp) | self.mmu.read_byte((sp + 1) & 0xFFFF) << 8',
+            'self.sp = (sp + 2) & 0xFFFF']
+
+
+def _indent(lines):
+    return ['    ' + line for line in lines]
+
+
+# Each template takes the operands and the taken cycles and returns
+# (lines, computed flags). The lines may end in their own return, otherwise
+# the flag update and the return of the base cycles are appended.
+
+def _ld(operands, taken):
+    dst, src = operands
+    if src == 'd16':
+        return ['word = ' + READ_WORD, 'self.pc += 2'] + _write_pair(dst, 'word'), {}
+    if dst == '(a16)' and src == 'SP':
+        return ['address = ' + READ_WORD, 'self.pc += 2',
+                'self.mmu.write_byte(address, self.sp & 0xFF)',
+                'self.mmu.write_byte((address + 1) & 0xFFFF, self.sp >> 8)'], {}
+    if dst == 'SP':
+        return ['self.sp = ' + _read_pair('HL')], {}
+    if src == 'SP+r8':
+        return _add_sp('HL')
+    if dst == src:
+        return [], {}
+    dst, src = Location(dst), Location(src)
+    return src.setup + dst.setup + [dst.write.format(src.read)] + src.post + dst.post, {}
+
+
+def _inc_dec(sign):
+    def template(operands, taken):
+        operand, = operands
+        if operand in PAIRS or operand == 'SP':
+            return [f'word = (({_read_pair(operand)}) {sign} 1) & 0xFFFF'] + _write_pair(operand, 'word'), {}
+        location = Location(operand)
+        lines = location.setup + ['value = ' + location.read,
+                                  f'result = (value {sign} 1) & 0xFF',
+                                  location.write.format('result')]
+        half = '(value & 0x0F) == 0x0F' if sign == '+' else 'not value & 0x0F'
+        return lines, {'Z': 'not result', 'H': half}
+    return template
+
+
+def _alu(operation):
+    def template(operands, taken):
+        source = Location(operands[-1])
+        lines = source.setup + ['value = ' + source.read, 'a = self.a']
+        if operation in ('AND', 'XOR', 'OR'):
+            symbol = {'AND': '&', 'XOR': '^', 'OR': '|'}[operation]
+            return lines + [f'self.a = result = a {symbol} value'], {'Z': 'not result'}
+
+        carry = operation in ('ADC', 'SBC')
+        if carry:
+            lines.append('carry = self.f >> 4 & 1')
+        if operation in ('ADD', 'ADC'):
+            lines.append('result = a + value' + (' + carry' if carry else ''))
+            half = '(a & 0x0F) + (value & 0x0F)' + (' + carry' if carry else '') + ' > 0x0F'
+            flags = {'Z': 'not result & 0xFF', 'H': half, 'C': 'result > 0xFF'}
+        else:
+            lines.append('result = a - value' + (' - carry' if carry else ''))
+            half = '(a & 0x0F) - (value & 0x0F)' + (' - carry' if carry else '') + ' < 0'
+            flags = {'Z': 'not result & 0xFF', 'H': half, 'C': 'result < 0'}
+        if operation != 'CP':
+            lines.append('self.a = result & 0xFF')
+        return lines, flags
+    return template
+
+
+def _add(operands, taken):
+    dst, src = operands
+    if dst == 'A':
+        return _alu('ADD')(operands, taken)
+    if dst == 'SP':
+        return _add_sp('SP')
+    lines = ['hl = ' + _read_pair('HL'), 'value = ' + _read_pair(src),
+             'result = hl + value', 'word = result & 0xFFFF'] + _write_pair('HL', 'word')
+    return lines, {'H': '(hl & 0x0FFF) + (value & 0x0FFF) > 0x0FFF', 'C': 'result > 0xFFFF'}
+
+
+def _add_sp(target):
+    # the offset is signed, the flags come from adding it unsigned to the low byte
+    lines = ['offset = ' + READ_PC, 'self.pc += 1', 'sp = self.sp',
+             'word = (sp + (offset ^ 0x80) - 0x80) & 0xFFFF'] + _write_pair(target, 'word')
+    return lines, {'H': '(sp & 0x0F) + (offset & 0x0F) > 0x0F', 'C': '(sp & 0xFF) + offset > 0xFF'}
+
+
+SHIFTS = {
+    # result, carry out
+    'RLC': ('(value << 1 | value >> 7) & 0xFF', 'value & 0x80'),
+    'RRC': ('(value >> 1 | value << 7) & 0xFF', 'value & 0x01'),
+    'RL': ('(value << 1 | self.f >> 4 & 1) & 0xFF', 'value & 0x80'),
+    'RR': ('value >> 1 | (self.f & 0x10) << 3', 'value & 0x01'),
+    'SLA': ('value << 1 & 0xFF', 'value & 0x80'),
+    'SRA': ('value >> 1 | value & 0x80', 'value & 0x01'),
+    'SWAP': ('(value << 4 | value >> 4) & 0xFF', None),
+    'SRL': ('value >> 1', 'value & 0x01'),
+}
+
+
+def _shift(operation):
+    def template(operands, taken):
+        # RLCA, RRCA, RLA and RRA are the CB shifts of A with Z always reset
+        location = Location(operands[0] if operands else 'A')
+        result, carry = SHIFTS[operation]
+        lines = location.setup + ['value = ' + location.read, 'result = ' + result,
+                                  location.write.format('result')]
+        return lines, {'Z': 'not result', 'C': carry}
+    return template
+
+
+def _bit(operands, taken):
+    bit, operand = operands
+    location = Location(operand)
+    return location.setup, {'Z': f'not {location.read} & {1 << int(bit):#04x}'}
+
+
+def _res_set(operation):
+    def template(operands, taken):
+        bit, operand = operands
+        location = Location(operand)
+        mask = 1 << int(bit)
+        value = f'{location.read} & {~mask & 0xFF:#04x}' if operation == 'RES' else f'{location.read} | {mask:#04x}'
+        return location.setup + [location.write.format(value)], {}
+    return template
+
+
+def _daa(operands, taken):
+    lines = [
+        'a = self.a',
+        'carry = self.f & 0x10',
+        'if self.f & 0x40:',
+        '    if carry:',
+        '        a -= 0x60',
+        '    if self.f & 0x20:',
+        '        a -= 0x06',
+        'else:',
+        '    if carry or a > 0x99:',
+        '        a += 0x60',
+        '        carry = 0x10',
+        '    if self.f & 0x20 or (a & 0x0F) > 0x09:',
+        '        a += 0x06',
+        'self.a = a = a & 0xFF',
+    ]
+    return lines, {'Z': 'not a', 'C': 'carry'}
+
+
+def _jr(operands, taken):
+    lines = ['offset = ' + READ_PC, 'self.pc += 1']
+    jump = ['self.pc = (self.pc + (offset ^ 0x80) - 0x80) & 0xFFFF']
+    if len(operands) == 1:
+        return lines + jump, {}
+    return lines + [f'if {CONDITIONS[operands[0]]}:'] + _indent(jump + [f'return {taken}']), {}
+
+
+def _jp(operands, taken):
+    if operands == ['(HL)']:
+        return ['self.pc = ' + _read_pair('HL')], {}
+    if len(operands) == 1:
+        return ['self.pc = ' + READ_WORD], {}
+    return ['address = ' + READ_WORD, 'self.pc += 2', f'if {CONDITIONS[operands[0]]}:']\
+        + _indent(['self.pc = address', f'return {taken}']), {}
+
+
+def _call(operands, taken):
+    lines = ['address = ' + READ_WORD, 'self.pc = pc = self.pc + 2']
+    call = _push('pc') + ['self.pc = address']
+    if len(operands) == 1:
+        return lines + call, {}
+    return lines + [f'if {CONDITIONS[operands[0]]}:'] + _indent(call + [f'return {taken}']), {}
+
+
+def _ret(operands, taken):
+    if not operands:
+        return _pop('self.pc'), {}
+    # checking the condition takes an M-cycle of its own
+    return ['IDLE', f'if {CONDITIONS[operands[0]]}:'] + _indent(_pop('self.pc') + [f'return {taken}']), {}
+
+
+def _reti(operands, taken):
+    return _pop('self.pc') + ['self.ime = 1'], {}
+
+
+def _rst(operands, taken):
+    return ['pc = self.pc'] + _push('pc') + [f'self.pc = 0x{operands[0][:2]}'], {}
+
+
+def _push_template(operands, taken):
+    return ['word = ' + _read_pair(operands[0])] + _push('word'), {}
+
+
+def _pop_template(operands, taken):
+    if operands[0] == 'AF':
+        # all four flags come off the stack, the low bits of F stay 0
+        return _pop('word') + ['self.a = word >> 8', 'self.f = word & 0xF0', 'return 12'], {}
+    return _pop('word') + _write_pair(operands[0], 'word'), {}
+
+
+def _prefix(operands, taken):
+    return ['opcode = ' + READ_PC, 'self.pc += 1', 'return self.cbcodes[opcode](self)'], {}
+
+
+def _simple(*lines, **flags):
+    return lambda operands, taken: (list(lines), dict(flags))
+
+
+TEMPLATES = {
+    'NOP': _simple(),
+    'LD': _ld,
+    'LDH': _ld,
+    'INC': _inc_dec('+'),
+    'DEC': _inc_dec('-'),
+    'ADD': _add,
+    'ADC': _alu('ADC'),
+    'SUB': _alu('SUB'),
+    'SBC': _alu('SBC'),
+    'AND': _alu('AND'),
+    'XOR': _alu('XOR'),
+    'OR': _alu('OR'),
+    'CP': _alu('CP'),
+    'RLCA': _shift('RLC'),
+    'RRCA': _shift('RRC'),
+    'RLA': _shift('RL'),
+    'RRA': _shift('RR'),
+    'DAA': _daa,
+    'CPL': _simple('self.a ^= 0xFF'),
+    'SCF': _simple(),
+    'CCF': _simple(C='not self.f & 0x10'),
+    'JR': _jr,
+    'JP': _jp,
+    'CALL': _call,
+    'RET': _ret,
+    'RETI': _reti,
+    'RST': _rst,
+    'PUSH': _push_template,
+    'POP': _pop_template,
+    'HALT': _simple('self.halted = 1'),
+    'STOP': _simple('self.pc += 1', 'self.mmu.stop()'),
+    'DI': _simple('self.ime = 0', 'self.ei_delay = 0'),
+    'EI': _simple('self.ei_delay = 1'),
+    'PREFIX': _prefix,
+    '-': _simple('return self._illegal()'),
+    'BIT': _bit,
+    'RES': _res_set('RES'),
+    'SET': _res_set('SET'),
+}
+TEMPLATES.update((name, _shift(name)) for name in SHIFTS)
+
+
+def _flag_update(spec, computed):
+    """ The statement applying a flags column, None if nothing changes """
+    keep = set_bits = 0
+    terms = []
+    for name, effect in zip('ZNHC', spec):
+        bit = FLAG_BITS[name]
+        if effect == '-':
+            keep |= bit
+        elif effect == '1':
+            set_bits |= bit
+        elif effect == name:
+            terms.append(f'({bit:#04x} if {computed[name]} else 0)')
+        elif effect != '0':
+            raise ValueError(f"bad flags column {spec}")
+    if keep == 0xF0:
+        return None
+    if set_bits:
+        terms.insert(0, f'{set_bits:#04x}')
+    if keep:
+        terms.insert(0, f'self.f & {keep:#04x}')
+    return 'self.f = ' + (' | '.join(terms) or '0')
+
+
+# RegisterFileCPU keeps the registers in one bytearray laid out F A C B E D L
+# H, with a 16-bit view over it holding AF, BC, DE and HL. Its handlers index
+# those directly instead of going through the register properties.
+REGISTER_INDEX = {'f': 0, 'a': 1, 'c': 2, 'b': 3, 'e': 4, 'd': 5, 'l': 6, 'h': 7}
+PAIR_INDEX = {('a', 'f'): 0, ('b', 'c'): 1, ('d', 'e'): 2, ('h', 'l'): 3}
+
+
+def _register_file(lines):
+    source = '\n'.join(lines)
+
+    def pair(match, replacement):
+        index = PAIR_INDEX.get((match.group('high'), match.group('low')))
+        return match.group(0) if index is None else replacement.format(index=index, **match.groupdict())
+    # word reads and the two byte writes of a word become one 16-bit access
+    source = re.sub(r'self\.(?P<high>[abdh]) << 8 \| self\.(?P<low>[fcel])\b',
+                    lambda match: pair(match, 'pairs[{index}]'), source)
+    source = re.sub(r'^(?P<indent> *)self\.(?P<high>[abdh]) = (?P<value>\w+) >> 8\n'
+                    r'(?P=indent)self\.(?P<low>[fcel]) = (?P=value) & 0xFF$',
+                    lambda match: pair(match, '{indent}pairs[{index}] = {value}'), source, flags=re.M)
+    source = re.sub(r'self\.([afbcdehl])\b',
+                    lambda match: f'registers[{REGISTER_INDEX[match.group(1)]}]', source)
+    lines = source.split('\n')
+    prelude = [f'{view} = self.{view}' for view in ('registers', 'pairs') if view + '[' in source]
+    return prelude + lines
+
+
+def handler_source(name, doc, instruction, accurate=False, register_file=False):
+    mnemonic, cycles, taken, flags = instruction
+    operation, _, operands = mnemonic.partition(' ')
+    operands = operands.split(',') if operands else []
+    lines, computed = TEMPLATES[operation](operands, taken)
+    if not (lines and lines[-1].startswith('return')):
+        update = _flag_update(flags, computed)
+        if update:
+            lines.append(update)
+        lines.append(f'return {cycles}')
+    # IDLE marks an internal M-cycle that comes before later memory accesses.
+    # Accurate handlers spend it there, fast ones leave it to the total.
+    lines = [line.replace('IDLE', 'self.mmu.tick(4)') for line in lines if accurate or line.strip() != 'IDLE']
+    if register_file:
+        lines = _register_file(lines)
+    return '\n'.join([f'def {name}(self):', f'    """ {doc}: {mnemonic} """'] + _indent(lines))
+
+
+def build_handlers(accurate=False, register_file=False):
+    """ Returns {name: function} for every op_0x.. and cb_0x.. handler. The
+    accurate set ticks internal M-cycles through mmu.tick() where they happen
+    (see Emulator accurate mode), the register_file set is for RegisterFileCPU. """
+    sources = [handler_source(f'op_0x{opcode:02x}', f'0x{opcode:02X}', instruction, accurate, register_file)
+               for opcode, instruction in enumerate(INSTRUCTIONS)]
+    sources += [handler_source(f'cb_0x{opcode:02x}', f'CB 0x{opcode:02X}', instruction, accurate,
+                               register_file)
+                for opcode, instruction in enumerate(CB_INSTRUCTIONS)]
+    source = '\n\n'.join(sources) + '\n'
+
+    # keep the generated source around so tracebacks can show it
+    filename = '<{}instructions>'.format(('accurate ' if accurate else '')
+                                         + ('register file ' if register_file else ''))
+    linecache.cache[filename] = (len(source), None, source.splitlines(True), filename)
+    namespace = {}
+    exec(compile(source, filename, 'exec'), namespace)
+    return {name: function for name, function in namespace.items() if name.startswith(('op_', 'cb_'))}
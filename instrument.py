@@ -0,0 +1,143 @@
+import time
+from time import perf_counter_ns
+
+import hooks
+
+# subsystem name -> (component attribute, method)
+SUBSYSTEMS = {
+    'cpu.step': ('cpu', 'step'),
+    'mmu.read_byte': ('mmu', 'read_byte'),
+    'mmu.write_byte': ('mmu', 'write_byte'),
+    'ppu.step': ('ppu', 'step'),
+    'ppu.render_scanline': ('ppu', '_render_scanline'),
+}
+
+
+def _timed(counter):
+    def factory(inner):
+        def wrapper(self, *args):
+            start = perf_counter_ns()
+            result = inner(self, *args)
+            counter[0] += 1
+            counter[1] += perf_counter_ns() - start
+            return result
+        return wrapper
+    return factory
+
+
+class Instrumentation:
+    """ Call counts and perf_counter_ns totals per subsystem, in total and
+    for the last frame.
+
+    enable() swaps timing wrappers into the emulator's CPU, MMU and PPU (and
+    the frontend's draw_framebuffer, if one is given) through hooks, and
+    disable() swaps the plain methods back, so there is no cost while off.
+    Times are inclusive: cpu.step contains the MMU accesses it makes.
+
+    gauges maps a name to a function returning text for the logged line,
+    for state that isn't a timing (memory held by the rewind history, ...). """
+
+    def __init__(self, emulator, frontend=None, log_interval=None, log=print):
+        self.emulator = emulator
+        self.frontend = frontend
+        self.log_interval = log_interval
+        self.log = log
+        self.enabled = False
+        self.gauges = {}
+
+        names = list(SUBSYSTEMS) + ['frame']
+        if frontend is not None:
+            names.append('draw_framebuffer')
+        # [calls, ns] for the frame in progress
+        self._current = {name: [0, 0] for name in names}
+        self._totals = {name: [0, 0] for name in names}
+        self._last = {name: [0, 0] for name in names}
+        self.frames = 0
+
+        self._log_start = time.perf_counter()
+        self._log_frames = 0
+        self._log_totals = {name: [0, 0] for name in names}
+
+    def enable(self):
+        if self.enabled:
+            return
+        wrappers = {}
+        for name, (component, method) in SUBSYSTEMS.items():
+            wrappers.setdefault(component, {})[method] = _timed(self._current[name])
+        for component, methods in wrappers.items():
+            hooks.install(getattr(self.emulator, component), self, methods)
+        hooks.install(self.emulator, self, {'run_frame': self._frame_wrapper})
+        if self.frontend is not None:
+            hooks.install(self.frontend, self,
+                          {'draw_framebuffer': _timed(self._current['draw_framebuffer'])})
+        self.enabled = True
+
+    def disable(self):
+        if not self.enabled:
+            return
+        for component in {component for component, _ in SUBSYSTEMS.values()}:
+            hooks.remove(getattr(self.emulator, component), self)
+        hooks.remove(self.emulator, self)
+        if self.frontend is not None:
+            hooks.remove(self.frontend, self)
+        self.enabled = False
+
+    def totals(self):
+        """ {subsystem: {'calls': n, 'ns': n}} since the last reset() """
+        return {name: {'calls': c[0], 'ns': c[1]} for name, c in self._totals.items()}
+
+    def last_frame(self):
+        """ Same as totals() for the most recently completed frame """
+        return {name: {'calls': c[0], 'ns': c[1]} for name, c in self._last.items()}
+
+    def reset(self):
+        for counters in (self._current, self._totals, self._last, self._log_totals):
+            for counter in counters.values():
+                counter[0] = counter[1] = 0
+        self.frames = 0
+
+    def _frame_wrapper(self, inner):
+        frame_counter = self._current['frame']
+
+        def run_frame(emulator):
+            start = perf_counter_ns()
+            inner(emulator)
+            frame_counter[0] += 1
+            frame_counter[1] += perf_counter_ns() - start
+            self._end_frame()
+        return run_frame
+
+    def _end_frame(self):
+        self.frames += 1
+        self._log_frames += 1
+        for name, counter in self._current.items():
+            last = self._last[name]
+            last[0], last[1] = counter
+            total = self._totals[name]
+            total[0] += counter[0]
+            total[1] += counter[1]
+            window = self._log_totals[name]
+            window[0] += counter[0]
+            window[1] += counter[1]
+            counter[0] = counter[1] = 0
+
+        if self.log_interval is not None:
+            now = time.perf_counter()
+            if now - self._log_start >= self.log_interval:
+                self.log(self._format_window())
+                self._log_start = now
+                self._log_frames = 0
+                for counter in self._log_totals.values():
+                    counter[0] = counter[1] = 0
+
+    def _format_window(self):
+        frames = max(1, self._log_frames)
+        parts = [f"{self._log_frames} frames"]
+        for name, (calls, ns) in self._log_totals.items():
+            if name == 'frame':
+                continue
+            parts.append(f"{name} {calls / frames:.0f}x {ns / frames / 1e6:.2f}ms")
+        frame_ms = self._log_totals['frame'][1] / frames / 1e6
+        parts.append(f"frame {frame_ms:.2f}ms")
+        gauges = [f"{name} {gauge()}" for name, gauge in self.gauges.items()]
+        return "stats: " + " | ".join(parts) + " (per frame)" + "".join(" | " + g for g in gauges)
@@ -0,0 +1,94 @@
+import struct
+
+# A joypad byte has one bit per held button: the action buttons in the low
+# nibble and the directions in the high nibble, each in JOYP line order.
+A, B, SELECT, START = 0x01, 0x02, 0x04, 0x08
+RIGHT, LEFT, UP, DOWN = 0x10, 0x20, 0x40, 0x80
+BUTTONS = {'a': A, 'b': B, 'select': SELECT, 'start': START,
+           'right': RIGHT, 'left': LEFT, 'up': UP, 'down': DOWN}
+
+# An input script is one joypad byte per frame, counted from power on, with
+# no buttons held past its end. On disk it is run-length encoded as
+# (frames, joypad byte) records.
+RUN = struct.Struct('<HB')
+
+
+def held(inputs, frame):
+    """ Joypad byte of the script at frame """
+    return inputs[frame] if frame < len(inputs) else 0
+
+
+def runs(inputs, start, stop):
+    """ Yields (frame, count, joypad byte) for the runs of equal bytes
+    between frames start and stop """
+    frame = start
+    while frame < stop:
+        buttons = held(inputs, frame)
+        end = frame + 1
+        if frame >= len(inputs):
+            end = stop
+        else:
+            while end < stop and held(inputs, end) == buttons:
+                end += 1
+        yield frame, end - frame, buttons
+        frame = end
+
+
+def encode(inputs):
+    """ Run-length encodes an input script """
+    script = bytearray()
+    for _, count, buttons in runs(inputs, 0, len(inputs)):
+        while count:
+            chunk = min(count, 0xFFFF)
+            script += RUN.pack(chunk, buttons)
+            count -= chunk
+    return bytes(script)
+
+
+def decode(script):
+    """ Expands an encode()d script to one joypad byte per frame """
+    if len(script) % RUN.size:
+        raise ValueError("truncated input script")
+    return b''.join(bytes((buttons,)) * count for count, buttons in RUN.iter_unpack(script))
+
+
+def parse(text):
+    """ Input script from text lines of '<frame> <button> ...'. Each line
+    holds its buttons from that frame until the next line, a line with no
+    buttons releases them all. The script ends at the last line, which
+    holds its buttons for that one frame. """
+    inputs = bytearray()
+    buttons = 0
+    previous = None # (frame, line number) of the last line
+    for number, line in enumerate(text.splitlines(), 1):
+        words = line.split('#', 1)[0].split()
+        if not words:
+            continue
+        try:
+            frame = int(words[0])
+        except ValueError:
+            raise ValueError(f"line {number}: expected a frame number, got '{words[0]}'")
+        if previous is not None and frame == previous[0]:
+            raise ValueError(f"line {number}: frame {frame} is already given on line {previous[1]}")
+        if frame < len(inputs):
+            raise ValueError(f"line {number}: frame {frame} is before the previous line")
+        previous = frame, number
+        inputs += bytes((buttons,)) * (frame - len(inputs))
+        buttons = 0
+        for name in words[1:]:
+            if name.lower() not in BUTTONS:
+                raise ValueError(f"line {number}: unknown button '{name}'")
+            buttons |= BUTTONS[name.lower()]
+    if buttons:
+        inputs.append(buttons)
+    return bytes(inputs)
+
+
+def load(path):
+    """ Reads an input script, text if the file ends in .txt, otherwise
+    run-length encoded """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if path.endswith('.txt'):
+        return parse(data.decode('ascii'))
+    return decode(data)
@@ -1,55 +1,351 @@
+# placeholder cartridge, shared by every MMU until a ROM is loaded
+NO_CARTRIDGE = bytes(0x8000)
+
+
+def _bank_handlers(buffer, base):
+    """ Page handlers for a bank held in its own buffer, mapped at base """
+    def read(address):
+        return buffer[address - base]
+
+    def write(address, value):
+        buffer[address - base] = value
+    return read, write
+
+
 class MMU:
+    __slots__ = ('memory', 'rom', 'mbc', 'serial_output', 'rom_bank', 'ram_bank',
+                 'ram_enabled', 'banking_mode', 'mapped_bank', 'read_ram', 'write_ram',
+                 'read_map', 'write_map', 'timer', 'buttons', 'cgb', 'vram', 'wram',
+                 'vram_bank', 'wram_bank', 'bg_palette', 'obj_palette', 'double_speed',
+                 'apu', 'ppu')
+
     def __init__(self):
         self.memory = bytearray(65536) # 64 * 1024
 
+        # whole cartridge image, 0x4000-0x7FFF holds a copy of the selected bank
+        self.rom = NO_CARTRIDGE
+        self.mbc = 0 # 0 = ROM only, 1 = MBC1
+
+        # bytes sent over the serial port (test ROMs print their results there)
+        self.serial_output = bytearray()
+
+        # MBC1 registers
+        self.rom_bank = 1
+        self.ram_bank = 0
+        self.ram_enabled = 0
+        self.banking_mode = 0
+        self.mapped_bank = 1 # bank currently visible at 0x4000-0x7FFF
+
+        # one read and one write handler per 256 byte page. Plain memory pages
+        # go straight to the bytearray; debug hooks and banking replace
+        # individual entries.
+        self.read_ram = self.memory.__getitem__
+        self.write_ram = self.memory.__setitem__
+        self.read_map = [self.read_ram] * 0xFF + [self._read_io]
+        self.write_map = [self._write_rom] * 0x80 + [self.write_ram] * 0x7F + [self._write_io]
+
+        # the Timer owning DIV, the APU owning the sound registers and the
+        # PPU owning STAT, set by the Emulator
+        self.timer = None
+        self.apu = None
+        self.ppu = None
+
+        # held buttons as a joypad byte (see joypad.py), neither button
+        # group selected in JOYP
+        self.buttons = 0
+        self.memory[0xFF00] = 0x30
+
+        # Game Boy Color mode, chosen by the cartridge header. VRAM bank 0
+        # and WRAM banks 0 and 1 live in memory, the other banks in their
+        # own buffers that are paged in through the memory map. They are
+        # only allocated for CGB cartridges.
+        self.cgb = 0
+        self.vram = None # [bank 0, bank 1], indexed by VBK
+        self.wram = None # [bank 0, ..., bank 7], 0xD000 shows SVBK's bank
+        self.vram_bank = 0
+        self.wram_bank = 1
+        self.bg_palette = None # 8 palettes of 4 little-endian BGR555 colors
+        self.obj_palette = None
+        self.double_speed = 0
+
     def read_byte(self, address):
+        return self.read_map[address >> 8](address)
+
+    def write_byte(self, address, value):
+        self.write_map[address >> 8](address, value)
+
+    def tick(self, cycles):
+        """ Internal M-cycles of an instruction in accurate timing mode. Does
+        nothing by itself, the Emulator hooks it to run the PPU and timer. """
+
+    def _read_io(self, address):
         if address == 0xFF00: # JOYP (Joypad)
-            #need to implement
-            return 0xFF
-        elif address == 0xFF04: # DIV (Divider Register)
-            #need to implement
-            return 0
+            return 0xC0 | (self.memory[address] & 0x30) | self._joypad_lines()
         elif address == 0xFF0F: # IF (Interrupt Flag)
             #need to implement
             return self.memory[address]
         elif 0xFF40 <= address <= 0xFF4B: # PPU registers
             #need to implement
             return self.memory[address]
+        elif 0xFF10 <= address <= 0xFF3F and self.apu is not None: # sound
+            return self.apu.read(address)
+        elif self.cgb and (address == 0xFF69 or address == 0xFF6B): # BCPD/OCPD
+            palette = self.bg_palette if address == 0xFF69 else self.obj_palette
+            return palette[self.memory[address - 1] & 0x3F]
 
         return self.memory[address]
 
-    def write_byte(self, address, value):
+    def _write_io(self, address, value):
         if address == 0xFF00: # JOYP (Joypad)
             # only bits 4 and 5 are writable (direction/action buttons select)
+            lines = self._joypad_lines()
             self.memory[address] = (self.memory[address] & 0xCF) | (value & 0x30)
+            self._joypad_changed(lines)
+            return
+        elif address == 0xFF02: # SC (Serial Control)
+            if value & 0x81 == 0x81:
+                # transfer on the internal clock: there is no link partner, so
+                # the byte completes at once and 0xFF shifts in
+                self.serial_output.append(self.memory[0xFF01])
+                self.memory[0xFF01] = 0xFF
+                self.memory[address] = value & 0x7F
+                self.memory[0xFF0F] |= 0x08 # Serial interrupt
+            else:
+                self.memory[address] = value
             return
         elif address == 0xFF04: # DIV (Divider Register)
-            # writing to DIV resets it to 0 (need to verify)
-            self.memory[address] = 0
+            # writing to DIV resets it to 0
+            if self.timer is not None:
+                self.timer.reset_divider()
+            else:
+                self.memory[address] = 0
             return
         elif address == 0xFF0F: # IF (Interrupt Flag)
             self.memory[address] = value | 0b11100000 # Lower 5 bits are writable
             return
+        elif 0xFF10 <= address <= 0xFF3F and self.apu is not None: # sound
+            self.apu.write(address, value)
+            return
         elif address == 0xFF44: # LY (LCD Y-coordinate) is read-only for CPU
             #modifying on for testing purposing
             self.memory[address] = value
             return
+        elif address == 0xFF41 or address == 0xFF45: # STAT, LYC
+            if address == 0xFF41:
+                # the mode and LY=LYC bits are read-only
+                value = (value & 0x78) | (self.memory[address] & 0x07)
+            self.memory[address] = value
+            if self.ppu is not None:
+                self.ppu.update_stat()
+            return
         elif 0xFF40 <= address <= 0xFF4B: # PPU registers
             self.memory[address] = value
             return
+        elif self.cgb and 0xFF4D <= address <= 0xFF70:
+            self._write_cgb(address, value)
+            return
 
-        if address < 0x8000:
-            #should be restricted
-            pass
         self.memory[address] = value
 
+    def _write_cgb(self, address, value):
+        memory = self.memory
+        if address == 0xFF4D: # KEY1: only the speed switch request is writable
+            memory[address] = (memory[address] & 0x80) | 0x7E | (value & 0x01)
+        elif address == 0xFF4F: # VBK
+            memory[address] = 0xFE | (value & 0x01)
+            self.map_vram_bank()
+        elif address == 0xFF55: # HDMA5
+            self._start_hdma(value)
+        elif address == 0xFF68 or address == 0xFF6A: # BCPS/OCPS
+            memory[address] = 0x40 | (value & 0xBF)
+        elif address == 0xFF69 or address == 0xFF6B: # BCPD/OCPD
+            palette = self.bg_palette if address == 0xFF69 else self.obj_palette
+            spec = memory[address - 1]
+            palette[spec & 0x3F] = value
+            if spec & 0x80: # auto-increment
+                memory[address - 1] = 0xC0 | ((spec + 1) & 0x3F)
+        elif address == 0xFF70: # SVBK
+            memory[address] = 0xF8 | (value & 0x07)
+            self.map_wram_bank()
+        else:
+            memory[address] = value
+
+    # --- CGB banking ---
+    def map_pages(self, first, last, read, write):
+        """ Points the handlers of pages first..last-1 at read and write """
+        self.read_map[first:last] = [read] * (last - first)
+        self.write_map[first:last] = [write] * (last - first)
+
+    def map_vram_bank(self):
+        self.vram_bank = self.memory[0xFF4F] & 0x01
+        if self.vram_bank:
+            self.map_pages(0x80, 0xA0, *_bank_handlers(self.vram[1], 0x8000))
+        else:
+            self.map_pages(0x80, 0xA0, self.read_ram, self.write_ram)
+
+    def map_wram_bank(self):
+        # bank 0 can't be selected at 0xD000, it reads as bank 1
+        self.wram_bank = (self.memory[0xFF70] & 0x07) or 1
+        if self.wram_bank > 1:
+            self.map_pages(0xD0, 0xE0, *_bank_handlers(self.wram[self.wram_bank], 0xD000))
+        else:
+            self.map_pages(0xD0, 0xE0, self.read_ram, self.write_ram)
+
+    def _bank_view(self, address):
+        # (buffer, offset) holding address with the current banks
+        if 0x8000 <= address < 0xA000:
+            return self.vram[self.vram_bank], address - 0x8000
+        if 0xD000 <= address < 0xE000:
+            return self.wram[self.wram_bank], address - 0xD000
+        return self.memory, address
+
+    # --- CGB VRAM DMA ---
+    def _start_hdma(self, value):
+        memory = self.memory
+        if not memory[0xFF55] & 0x80 and not value & 0x80:
+            # writing bit 7 clear during an HBlank transfer stops it
+            memory[0xFF55] |= 0x80
+            return
+        if value & 0x80:
+            # HBlank DMA: 16 bytes per HBlank, driven by the PPU. HDMA5
+            # holds the blocks left minus one, bit 7 clear while active.
+            memory[0xFF55] = value & 0x7F
+        else:
+            # general purpose DMA: the whole transfer at once
+            self._vram_dma((value & 0x7F) + 1)
+            memory[0xFF55] = 0xFF
+
+    def hblank_dma(self):
+        """ Copies the next 16 bytes of an HBlank DMA, called by the PPU on
+        entering HBlank while HDMA5 bit 7 is clear """
+        memory = self.memory
+        self._vram_dma(1)
+        left = memory[0xFF55] & 0x7F
+        memory[0xFF55] = 0xFF if left == 0 else left - 1
+
+    def _vram_dma(self, blocks):
+        # one slice copy per source bank, the source and destination
+        # registers advance past the copied blocks
+        memory = self.memory
+        source = (memory[0xFF51] << 8 | memory[0xFF52]) & 0xFFF0
+        dest = (memory[0xFF53] << 8 | memory[0xFF54]) & 0x1FF0
+        length = min(blocks * 16, 0x2000 - dest)
+        data = bytearray()
+        address = source
+        while len(data) < length:
+            chunk = min(length - len(data), 0x1000 - (address & 0x0FFF))
+            buffer, offset = self._bank_view(address)
+            data += buffer[offset:offset + chunk]
+            address = (address + chunk) & 0xFFFF
+        self.vram[self.vram_bank][dest:dest + length] = data
+
+        source = (source + blocks * 16) & 0xFFFF
+        dest = (dest + blocks * 16) & 0x1FFF
+        memory[0xFF51] = source >> 8
+        memory[0xFF52] = source & 0xFF
+        memory[0xFF53] = dest >> 8
+        memory[0xFF54] = dest & 0xFF
+
+    def stop(self):
+        """ STOP switches the CGB CPU speed when KEY1 asked for it """
+        if self.cgb and self.memory[0xFF4D] & 0x01:
+            self.double_speed ^= 1
+            self.memory[0xFF4D] = self.double_speed << 7 | 0x7E
+            if self.timer is not None:
+                self.timer.reset_divider()
+
+    def set_buttons(self, buttons):
+        """ Holds the buttons of a joypad byte, releasing all others """
+        lines = self._joypad_lines()
+        self.buttons = buttons & 0xFF
+        self._joypad_changed(lines)
+
+    def _joypad_lines(self):
+        # low nibble of JOYP: a line reads 0 while a button of a selected
+        # group on it is held
+        select = self.memory[0xFF00]
+        pressed = 0
+        if not select & 0x10:
+            pressed |= self.buttons >> 4
+        if not select & 0x20:
+            pressed |= self.buttons
+        return ~pressed & 0x0F
+
+    def _joypad_changed(self, lines):
+        # a line going from high to low requests the Joypad interrupt
+        if lines & ~self._joypad_lines():
+            self.memory[0xFF0F] |= 0x10
+
+    def _write_rom(self, address, value):
+        # ROM is read-only, writes go to the cartridge's bank controller
+        if self.mbc:
+            self._write_mbc1(address, value)
+
+    def _write_mbc1(self, address, value):
+        if address < 0x2000:
+            self.ram_enabled = int((value & 0x0F) == 0x0A)
+            return
+        elif address < 0x4000:
+            self.rom_bank = value & 0x1F
+        elif address < 0x6000:
+            self.ram_bank = value & 0x03
+        else:
+            self.banking_mode = value & 0x01
+        self.map_rom_bank()
+
+    def map_rom_bank(self):
+        # a bank number of 0 in the low bits selects bank 1
+        bank = self.rom_bank or 1
+        if not self.banking_mode:
+            bank |= self.ram_bank << 5
+        bank %= max(1, len(self.rom) // 0x4000)
+        self.mapped_bank = bank
+        bank_data = self.rom[bank * 0x4000:(bank + 1) * 0x4000]
+        self.memory[0x4000:0x4000 + len(bank_data)] = bank_data
+
     def load_rom(self, rom_path):
         try:
             with open(rom_path, 'rb') as f:
-                rom_data = f.read()
-                self.memory[0x0000:len(rom_data)] = rom_data
+                self.load_rom_data(f.read())
             print(f"ROM '{rom_path}' loaded successfully.")
         except FileNotFoundError:
             print(f"Error: ROM file not found at '{rom_path}'")
         except Exception as e:
-            print(f"An error occurred while loading the ROM: {e}")
\ No newline at end of file
+            print(f"An error occurred while loading the ROM: {e}")
+
+    def load_rom_data(self, rom_data):
+        self.rom = bytes(rom_data)
+        self.mbc = 1 if len(self.rom) > 0x147 and 0x01 <= self.rom[0x147] <= 0x03 else 0
+        self._init_cgb(len(self.rom) > 0x143 and self.rom[0x143] & 0x80)
+        self.rom_bank = 1
+        self.ram_bank = 0
+        self.ram_enabled = 0
+        self.banking_mode = 0
+
+        # bank 0 is fixed, the switchable bank is copied in by map_rom_bank()
+        bank0 = self.rom[:0x4000]
+        self.memory[0x0000:len(bank0)] = bank0
+        self.map_rom_bank()
+
+    def _init_cgb(self, cgb):
+        memory = self.memory
+        self.cgb = int(bool(cgb))
+        self.double_speed = 0
+        if not self.cgb:
+            self.vram = self.wram = self.bg_palette = self.obj_palette = None
+            self.vram_bank, self.wram_bank = 0, 1
+            self.map_pages(0x80, 0xA0, self.read_ram, self.write_ram)
+            self.map_pages(0xD0, 0xE0, self.read_ram, self.write_ram)
+            return
+        view = memoryview(memory)
+        self.vram = [view[0x8000:0xA000], bytearray(0x2000)]
+        self.wram = [view[0xC000:0xD000], view[0xD000:0xE000]]
+        self.wram += [bytearray(0x1000) for _ in range(6)]
+        self.bg_palette = bytearray(b'\xff\x7f' * 32) # white
+        self.obj_palette = bytearray(64)
+        memory[0xFF4D] = 0x7E
+        memory[0xFF4F] = 0xFE
+        memory[0xFF55] = 0xFF
+        memory[0xFF70] = 0xF9
+        self.map_vram_bank()
+        self.map_wram_bank()
@@ -0,0 +1,64 @@
+import time
+
+from emulator import CLOCK_SPEED, CYCLES_PER_FRAME, FRAME_RATE
+
+# leave the last stretch of each wait to a busy loop, time.sleep() overshoots
+SPIN_SECONDS = 0.002
+
+# further behind than this and we stop trying to catch up
+MAX_LAG_FRAMES = 5
+
+
+class Pacer:
+    """ Paces emulated frames against wall time.
+
+    speed=1.0 runs at the hardware rate (~59.73 Hz), other values run at that
+    multiple of it and speed=None runs uncapped. Frame deadlines are computed
+    from a fixed start time rather than from the previous frame, so sleep
+    overshoot does not accumulate into drift. """
+
+    def __init__(self, speed=1.0, report=print):
+        if speed is not None and speed <= 0:
+            raise ValueError(f"speed must be positive, got {speed}")
+        self.speed = speed
+        self.report = report
+        self._start = time.perf_counter()
+        self._frames = 0
+
+        # achieved speed over the current one second window
+        self._window_start = self._start
+        self._window_frames = 0
+        self.achieved_speed = 0.0
+
+    def reset(self):
+        self._start = time.perf_counter()
+        self._frames = 0
+
+    def frame_done(self):
+        """ Call once per emulated frame; waits until the frame is due """
+        self._frames += 1
+        self._window_frames += 1
+
+        if self.speed:
+            period = 1.0 / (FRAME_RATE * self.speed)
+            deadline = self._start + self._frames * period
+            now = time.perf_counter()
+            if now - deadline > MAX_LAG_FRAMES * period:
+                # too slow to keep up (or we were paused), restart the schedule
+                self._start = now
+                self._frames = 0
+            elif deadline > now:
+                if deadline - now > SPIN_SECONDS:
+                    time.sleep(deadline - now - SPIN_SECONDS)
+                while time.perf_counter() < deadline:
+                    pass
+
+        now = time.perf_counter()
+        elapsed = now - self._window_start
+        if elapsed >= 1.0:
+            fps = self._window_frames / elapsed
+            self.achieved_speed = fps * CYCLES_PER_FRAME / CLOCK_SPEED
+            if self.report is not None:
+                self.report(f"speed: {self.achieved_speed:.2f}x ({fps:.2f} fps)")
+            self._window_start = now
+            self._window_frames = 0
@@ -1,84 +1,161 @@
 class PPU:
+    __slots__ = ('mmu', 'cpu', 'framebuffer', 'dirty_lines', 'dots', 'mode', 'stat_line')
+
+    # Gameboy colors
+    colors = (
+        (255, 255, 255), # White
+        (192, 192, 192), # Light Gray
+        (96, 96, 96),   # Dark Gray
+        (0, 0, 0),       # Black
+    )
+
     def __init__(self, mmu, cpu):
         self.mmu = mmu
         self.cpu = cpu
 
-        # 2d array of pixels
-        self.framebuffer = [[(255, 255, 255)] * 160 for _ in range(144)]
+        # 160x144 shade indices (0-3, after the palette), one byte per pixel.
+        # In CGB mode a pixel is palette * 4 + color instead (see palette()).
+        self.framebuffer = bytearray(160 * 144)
 
-        # Gameboy colors
-        self.colors = [
-            (255, 255, 255), # White
-            (192, 192, 192), # Light Gray
-            (96, 96, 96),   # Dark Gray
-            (0, 0, 0),       # Black
-        ]
+        # scanlines that changed since the frontend last presented a frame
+        self.dirty_lines = bytearray(b'\x01' * 144)
 
         # PPU state
         self.dots = 0
         self.mode = 2 # Start in OAM Scan mode
 
+        # the STAT interrupt is requested when this goes from low to high
+        self.stat_line = False
+
     def step(self, cycles):
-        lcdc = self.mmu.read_byte(0xFF40)
+        # the PPU reads and writes its registers and VRAM directly, not
+        # through the CPU's memory map (and so never through debug hooks or
+        # accurate timing ticks)
+        memory = self.mmu.memory
+        lcdc = memory[0xFF40]
         if not (lcdc >> 7) & 1:
             # LCD is disabled
-            self.mmu.write_byte(0xFF44, 0)
+            memory[0xFF44] = 0
+            memory[0xFF41] &= 0xFC
             self.dots = 0
             self.mode = 0
+            self.stat_line = False
             return
 
         self.dots += cycles
 
         # LY is the current horizontal line being drawn
-        ly = self.mmu.read_byte(0xFF44)
+        ly = memory[0xFF44]
 
-        if self.mode == 2: # OAM Scan
-            if self.dots >= 80:
-                self.dots = 0
+        # a long instruction (see blockops.py) can cover several mode changes,
+        # leftover dots carry over into the next mode
+        while True:
+            if self.mode == 2: # OAM Scan
+                if self.dots < 80:
+                    return
+                self.dots -= 80
                 self.mode = 3
-        elif self.mode == 3: # Drawing
-            if self.dots >= 172:
-                self.dots = 0
+                self.update_stat()
+            elif self.mode == 3: # Drawing
+                if self.dots < 172:
+                    return
+                self.dots -= 172
                 self.mode = 0
+                self.update_stat()
                 self._render_scanline(ly)
-        elif self.mode == 0: # H-Blank
-            if self.dots >= 204:
-                self.dots = 0
+                if self.mmu.cgb and not memory[0xFF55] & 0x80: # HBlank DMA active
+                    self.mmu.hblank_dma()
+            elif self.mode == 0: # H-Blank
+                if self.dots < 204:
+                    return
+                self.dots -= 204
                 ly += 1
                 if ly <= 144:
-                    self.mmu.write_byte(0xFF44, ly)
+                    memory[0xFF44] = ly
                 if ly == 144:
                     self.mode = 1
                     # Trigger V-Blank interrupt
-                    self.cpu.ime = 1 # For now, just enable interrupts, need to implement interrupt system
-                    self.mmu.write_byte(0xFF0F, self.mmu.read_byte(0xFF0F) | 1)
+                    memory[0xFF0F] |= 0x01
                 else:
                     self.mode = 2
-        elif self.mode == 1: # V-Blank
-            if self.dots >= 456:
-                self.dots = 0
+                self.update_stat()
+            elif self.mode == 1: # V-Blank
+                if self.dots < 456:
+                    return
+                self.dots -= 456
                 ly += 1
                 if ly <= 153:
-                    self.mmu.write_byte(0xFF44, ly)
+                    memory[0xFF44] = ly
                 if ly > 153:
+                    ly = 0
                     self.mode = 2
-                    self.mmu.write_byte(0xFF44, 0)
+                    memory[0xFF44] = 0
+                self.update_stat()
+
+    def update_stat(self, request=True):
+        """ Sets STAT's mode and LY=LYC bits and requests the STAT interrupt
+        when one of its enabled sources comes on. Called on every mode or LY
+        change and by the MMU on STAT and LYC writes. """
+        memory = self.mmu.memory
+        coincidence = memory[0xFF44] == memory[0xFF45]
+        stat = 0x80 | (memory[0xFF41] & 0x78) | coincidence << 2 | self.mode
+        memory[0xFF41] = stat
+        # sources: HBlank (bit 3), VBlank (4), OAM scan (5) and LY=LYC (6)
+        line = bool(memory[0xFF40] & 0x80) and bool(
+            (coincidence and stat & 0x40) or (self.mode < 3 and stat & (0x08 << self.mode)))
+        if line and not self.stat_line and request:
+            memory[0xFF0F] |= 0x02
+        self.stat_line = line
+
+    def take_dirty_lines(self):
+        """ Returns the scanlines changed since the last call and clears them """
+        dirty = self.dirty_lines
+        if not any(dirty):
+            return []
+        lines = [y for y in range(144) if dirty[y]]
+        self.dirty_lines = bytearray(144)
+        return lines
+
+    def palette(self):
+        """ RGB colors of the framebuffer values: the four shades, or in
+        CGB mode the 8 background palettes then the 8 object palettes """
+        if not self.mmu.cgb:
+            return self.colors
+        colors = []
+        for palettes in (self.mmu.bg_palette, self.mmu.obj_palette):
+            for i in range(0, 64, 2):
+                color = palettes[i] | palettes[i + 1] << 8
+                colors.append(tuple((c << 3) | (c >> 2) for c in
+                                    (color & 0x1F, color >> 5 & 0x1F, color >> 10 & 0x1F)))
+        return colors
 
     def _render_scanline(self, ly):
-        lcdc = self.mmu.read_byte(0xFF40)
-        
-        # Is background enabled?
-        if (lcdc >> 0) & 1:
-            self._render_background(ly, lcdc)
+        lcdc = self.mmu.memory[0xFF40]
+        row = bytearray(160)
+
+        if self.mmu.cgb:
+            # LCDC bit 0 is BG priority on CGB, the background is always drawn
+            self._render_background_cgb(ly, lcdc, row)
+        elif not (lcdc >> 0) & 1: # Is background enabled?
+            return
+        else:
+            self._render_background(ly, lcdc, row)
 
         # Are sprites enabled? (Not implemented yet)
         # if (lcdc >> 1) & 1:
-        #     self._render_sprites(ly, lcdc)
+        #     self._render_sprites(ly, lcdc, row)
+
+        # only touch the framebuffer (and flag the line) when something changed
+        start = ly * 160
+        if self.framebuffer[start:start + 160] != row:
+            self.framebuffer[start:start + 160] = row
+            self.dirty_lines[ly] = 1
 
-    def _render_background(self, ly, lcdc):
-        scy = self.mmu.read_byte(0xFF42)
-        scx = self.mmu.read_byte(0xFF43)
-        bgp = self.mmu.read_byte(0xFF47)
+    def _render_background(self, ly, lcdc, row):
+        memory = self.mmu.memory
+        scy = memory[0xFF42]
+        scx = memory[0xFF43]
+        bgp = memory[0xFF47]
 
         tile_map_addr = 0x9C00 if (lcdc >> 3) & 1 else 0x9800
         tile_data_addr = 0x8000 if (lcdc >> 4) & 1 else 0x8800
@@ -92,7 +169,7 @@ class PPU:
             tile_map_y = y_in_map // 8
             
             tile_id_addr = tile_map_addr + tile_map_y * 32 + tile_map_x
-            tile_id = self.mmu.read_byte(tile_id_addr)
+            tile_id = memory[tile_id_addr]
             
             if tile_data_addr == 0x8800: #signed tiles
                 tile_data_start = tile_data_addr + ((tile_id) * 16)
@@ -101,8 +178,8 @@ class PPU:
 
             y_in_tile = y_in_map % 8
             
-            byte1 = self.mmu.read_byte(tile_data_start + y_in_tile * 2)
-            byte2 = self.mmu.read_byte(tile_data_start + y_in_tile * 2 + 1)
+            byte1 = memory[tile_data_start + y_in_tile * 2]
+            byte2 = memory[tile_data_start + y_in_tile * 2 + 1]
             
             x_in_tile = x_in_map % 8
             
@@ -111,5 +188,44 @@ class PPU:
             
             # Map color id to actual color using BGP
             palette_color = (bgp >> (color_id * 2)) & 0b11
-            
-            self.framebuffer[ly][x] = self.colors[palette_color]
\ No newline at end of file
+
+            row[x] = palette_color
+
+    def _render_background_cgb(self, ly, lcdc, row):
+        # VRAM bank 1 holds an attribute byte for every tile map entry:
+        # palette (bits 0-2), tile bank (3), x flip (5) and y flip (6)
+        memory = self.mmu.memory
+        tiles = self.mmu.vram
+        attributes = tiles[1]
+        scy = memory[0xFF42]
+        scx = memory[0xFF43]
+
+        tile_map = 0x1C00 if (lcdc >> 3) & 1 else 0x1800 # offsets into VRAM
+        unsigned = (lcdc >> 4) & 1
+
+        y_in_map = (ly + scy) & 0xFF
+        map_row = tile_map + (y_in_map // 8) * 32
+
+        for x in range(160):
+            x_in_map = (x + scx) & 0xFF
+            map_index = map_row + x_in_map // 8
+            tile_id = tiles[0][map_index]
+            attribute = attributes[map_index]
+
+            if unsigned:
+                tile_data_start = tile_id * 16
+            else: # signed tile numbers around 0x9000
+                tile_data_start = 0x1000 + ((tile_id ^ 0x80) - 0x80) * 16
+
+            y_in_tile = y_in_map % 8
+            if attribute & 0x40:
+                y_in_tile = 7 - y_in_tile
+            data = tiles[(attribute >> 3) & 1]
+            byte1 = data[tile_data_start + y_in_tile * 2]
+            byte2 = data[tile_data_start + y_in_tile * 2 + 1]
+
+            x_in_tile = x_in_map % 8
+            bit = x_in_tile if attribute & 0x20 else 7 - x_in_tile
+            color_id = ((byte2 >> bit) & 1) << 1 | ((byte1 >> bit) & 1)
+
+            row[x] = (attribute & 0x07) << 2 | color_id
@@ -0,0 +1,174 @@
+import argparse
+import sys
+from array import array
+
+import hooks
+from disasm import CB_MNEMONICS, MNEMONICS, disassemble_range
+
+# opcodes that can jump backwards to form a loop (JR and JP, all conditions)
+BRANCHES = frozenset([0x18, 0x20, 0x28, 0x30, 0x38, 0xC2, 0xC3, 0xCA, 0xD2, 0xDA])
+
+
+class Profiler:
+    """ Profiles the emulated program: executions and cycles per opcode (CB
+    prefixed ones separately), executions per bank:PC, and taken backward
+    branches, which mark the hot loops.
+
+    start() wraps CPU.step through hooks and stop() unwraps it. With
+    sample_every=N only every Nth instruction is recorded, so counts are
+    samples and cycles are those of the sampled instructions. """
+
+    def __init__(self, emulator, sample_every=1):
+        self.emulator = emulator
+        self.sample_every = sample_every
+        self.running = False
+        self.reset()
+
+    def reset(self):
+        self.opcode_counts = array('Q', bytes(8 * 256))
+        self.opcode_cycles = array('Q', bytes(8 * 256))
+        self.cb_counts = array('Q', bytes(8 * 256))
+        self.cb_cycles = array('Q', bytes(8 * 256))
+        self.pc_counts = {}   # (bank, pc) -> count
+        self.loop_counts = {} # (bank, loop start, branch address) -> count
+        self.halted_cycles = 0
+        self.samples = 0
+
+    def start(self):
+        if not self.running:
+            hooks.install(self.emulator.cpu, self, {'step': self._step_wrapper})
+            self.running = True
+
+    def stop(self):
+        if self.running:
+            hooks.remove(self.emulator.cpu, self)
+            self.running = False
+
+    def _step_wrapper(self, inner):
+        mmu = self.emulator.mmu
+        memory = mmu.memory
+        opcode_counts, opcode_cycles = self.opcode_counts, self.opcode_cycles
+        cb_counts, cb_cycles = self.cb_counts, self.cb_cycles
+        pc_counts, loop_counts = self.pc_counts, self.loop_counts
+        every = self.sample_every
+        countdown = [every]
+
+        def step(cpu):
+            if every > 1:
+                countdown[0] -= 1
+                if countdown[0]:
+                    return inner(cpu)
+                countdown[0] = every
+
+            if cpu.halted:
+                cycles = inner(cpu)
+                self.halted_cycles += cycles
+                return cycles
+
+            pc = cpu.pc
+            opcode = memory[pc]
+            cycles = inner(cpu)
+            self.samples += 1
+
+            if opcode == 0xCB:
+                cb = memory[(pc + 1) & 0xFFFF]
+                cb_counts[cb] += 1
+                cb_cycles[cb] += cycles
+            opcode_counts[opcode] += 1
+            opcode_cycles[opcode] += cycles
+
+            bank = mmu.mapped_bank if 0x4000 <= pc < 0x8000 else 0
+            key = (bank, pc)
+            pc_counts[key] = pc_counts.get(key, 0) + 1
+
+            if opcode in BRANCHES:
+                target = cpu.pc
+                if target <= pc and pc - target < 0x1000:
+                    loop = (bank, target, pc)
+                    loop_counts[loop] = loop_counts.get(loop, 0) + 1
+            return cycles
+        return step
+
+    def _reader(self, bank):
+        """ read_byte for code in the given ROM bank, whatever is mapped now """
+        mmu = self.emulator.mmu
+        memory = mmu.memory
+        rom = mmu.rom
+
+        def read(address):
+            if bank and 0x4000 <= address < 0x8000:
+                offset = bank * 0x4000 + address - 0x4000
+                return rom[offset] if offset < len(rom) else 0xFF
+            return memory[address]
+        return read
+
+    def hot_opcodes(self, top=10):
+        """ [(opcode, mnemonic, count, cycles)] sorted by cycles """
+        # the CB prefix itself is left out, its opcodes are listed individually
+        rows = [(op, MNEMONICS[op], self.opcode_counts[op], self.opcode_cycles[op])
+                for op in range(256) if self.opcode_counts[op] and op != 0xCB]
+        rows += [(0xCB00 | op, CB_MNEMONICS[op], self.cb_counts[op], self.cb_cycles[op])
+                 for op in range(256) if self.cb_counts[op]]
+        rows.sort(key=lambda row: row[3], reverse=True)
+        return rows[:top]
+
+    def hot_addresses(self, top=10):
+        """ [(bank, pc, count)] sorted by count """
+        rows = sorted(self.pc_counts.items(), key=lambda item: item[1], reverse=True)
+        return [(bank, pc, count) for (bank, pc), count in rows[:top]]
+
+    def hot_loops(self, top=10):
+        """ [(bank, start, branch address, iterations, disassembly)] """
+        rows = sorted(self.loop_counts.items(), key=lambda item: item[1], reverse=True)
+        loops = []
+        for (bank, start, end), count in rows[:top]:
+            loops.append((bank, start, end, count, disassemble_range(self._reader(bank), start, end)))
+        return loops
+
+    def report(self, top=10):
+        total = sum(self.opcode_cycles) or 1
+        lines = []
+        sampled = f" (every {self.sample_every}th instruction)" if self.sample_every > 1 else ""
+        lines.append(f"{self.samples} instructions recorded{sampled}, "
+                     f"{self.halted_cycles} cycles halted")
+
+        lines.append("\nHot opcodes by cycles:")
+        for opcode, mnemonic, count, cycles in self.hot_opcodes(top):
+            name = f"CB {opcode & 0xFF:02X}" if opcode > 0xFF else f"{opcode:02X}"
+            lines.append(f"  {name:>5}  {mnemonic:<14} {count:>10} {cycles:>12} {cycles / total:7.2%}")
+
+        lines.append("\nHot addresses:")
+        for bank, pc, count in self.hot_addresses(top):
+            text = disassemble_range(self._reader(bank), pc, pc)[0][2]
+            lines.append(f"  {bank:02X}:{pc:04X}  {count:>10}  {text}")
+
+        lines.append("\nHot loops:")
+        for bank, start, end, count, body in self.hot_loops(top):
+            lines.append(f"  {bank:02X}:{start:04X}-{end:04X}  {count} iterations")
+            for address, raw, text in body:
+                lines.append(f"      {address:04X}  {raw.hex():<8} {text}")
+        return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Profile where a ROM spends its emulated time")
+    parser.add_argument('rom')
+    parser.add_argument('--skip', type=int, default=0, help="frames to run before profiling")
+    parser.add_argument('--frames', type=int, default=600, help="frames to profile")
+    parser.add_argument('--sample', type=int, default=1, help="record every Nth instruction")
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args(argv)
+
+    from emulator import Emulator
+    emulator = Emulator(args.rom)
+    profiler = Profiler(emulator, sample_every=args.sample)
+    emulator.run_frames(args.skip)
+    profiler.start()
+    emulator.run_frames(args.frames)
+    profiler.stop()
+    print(profiler.report(args.top))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
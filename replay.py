@@ -0,0 +1,116 @@
+import argparse
+import hashlib
+import struct
+import sys
+
+from emulator import Emulator
+import joypad
+from savestate import CPU_STATE, cpu_registers
+
+MAGIC = b'GBFH'
+VERSION = 3
+
+# magic, version, first frame, frame count, ROM SHA-1, input script SHA-1,
+# interpreter tier (accurate, block operations)
+HEADER = struct.Struct('<4sHII20s20s??')
+# framebuffer hash, CPU registers + WRAM hash
+RECORD = struct.Struct('<8s8s')
+
+
+def frame_digests(emulator):
+    """ (framebuffer hash, CPU + WRAM hash) of the emulator's current state """
+    frame = hashlib.blake2b(emulator.ppu.framebuffer, digest_size=8).digest()
+    state = hashlib.blake2b(CPU_STATE.pack(*cpu_registers(emulator.cpu)), digest_size=8)
+    mmu = emulator.mmu
+    if mmu.cgb:
+        # all eight banks, not only the one SVBK shows at 0xD000
+        for bank in mmu.wram:
+            state.update(bank)
+    else:
+        state.update(memoryview(mmu.memory)[0xC000:0xE000])
+    return frame, state.digest()
+
+
+def record(emulator, frames, inputs=b''):
+    """ Runs frames frames driven by the input script (one joypad byte per
+    frame) and returns the hash log of every one of them """
+    start = emulator.frame
+    log = bytearray(HEADER.pack(MAGIC, VERSION, start, frames,
+                                hashlib.sha1(emulator.mmu.rom).digest(),
+                                hashlib.sha1(bytes(inputs)).digest(),
+                                emulator.accurate, emulator.block_ops))
+    for _ in range(frames):
+        emulator.run_inputs(inputs, 1)
+        log += RECORD.pack(*frame_digests(emulator))
+    return bytes(log)
+
+
+def verify(emulator, log, inputs=b''):
+    """ Replays a log from record() and stops at the first frame whose hashes
+    differ. Returns None if every frame matched, otherwise (frame, what)
+    where what is 'framebuffer', 'state' or 'framebuffer+state'. The
+    emulator has to run the tier (accurate, block_ops) the log was recorded
+    with. """
+    (magic, version, start, frames, rom_sha1, inputs_sha1,
+     accurate, block_ops) = HEADER.unpack_from(log, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("not a frame hash log, or an unsupported version")
+    if rom_sha1 != hashlib.sha1(emulator.mmu.rom).digest():
+        raise ValueError("log was recorded with a different ROM")
+    if inputs_sha1 != hashlib.sha1(bytes(inputs)).digest():
+        raise ValueError("log was recorded with a different input script")
+    if (accurate, block_ops) != (emulator.accurate, emulator.block_ops):
+        raise ValueError(f"log was recorded with accurate={accurate} block_ops={block_ops}, "
+                         f"emulator has accurate={emulator.accurate} "
+                         f"block_ops={emulator.block_ops}")
+    if emulator.frame != start:
+        raise ValueError(f"log starts at frame {start}, emulator is at frame {emulator.frame}")
+
+    offset = HEADER.size
+    for _ in range(frames):
+        emulator.run_inputs(inputs, 1)
+        frame_hash, state_hash = frame_digests(emulator)
+        expected_frame, expected_state = RECORD.unpack_from(log, offset)
+        offset += RECORD.size
+        if frame_hash != expected_frame or state_hash != expected_state:
+            what = []
+            if frame_hash != expected_frame:
+                what.append('framebuffer')
+            if state_hash != expected_state:
+                what.append('state')
+            return emulator.frame, '+'.join(what)
+    return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Record or verify per-frame hashes of a ROM run")
+    parser.add_argument('mode', choices=['record', 'verify'])
+    parser.add_argument('rom')
+    parser.add_argument('log')
+    parser.add_argument('--frames', type=int, default=600, help="frames to record")
+    parser.add_argument('--inputs', help="input script (.txt or run-length encoded, see joypad.py)")
+    parser.add_argument('--accurate', action='store_true', help="M-cycle accurate timing")
+    parser.add_argument('--no-block-ops', action='store_true',
+                        help="run copy and fill loops one instruction at a time")
+    args = parser.parse_args(argv)
+
+    inputs = joypad.load(args.inputs) if args.inputs else b''
+    emulator = Emulator(args.rom, accurate=args.accurate, block_ops=not args.no_block_ops)
+    if args.mode == 'record':
+        with open(args.log, 'wb') as f:
+            f.write(record(emulator, args.frames, inputs))
+        print(f"Recorded {args.frames} frames to {args.log}")
+        return 0
+
+    with open(args.log, 'rb') as f:
+        divergence = verify(emulator, f.read(), inputs)
+    if divergence is None:
+        print("All frames match")
+        return 0
+    frame, what = divergence
+    print(f"Diverged at frame {frame} ({what})")
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,141 @@
+import zlib
+from collections import deque
+
+from emulator import FRAME_RATE
+
+# granularity of the XOR deltas against the keyframe
+PAGE_SIZE = 256
+
+
+class Rewind:
+    """ Ring of recent savestates for stepping backwards in time.
+
+    Every keyframe_interval-th capture stores a full zlib-compressed state;
+    the captures in between store only the pages that differ from that
+    keyframe, XORed against it and compressed. Restoring any capture costs
+    one keyframe decompress plus one delta, however long the history is.
+    Oldest history is evicted a keyframe group at a time once either the
+    requested number of seconds or max_bytes is exceeded. """
+
+    def __init__(self, emulator, seconds=10, interval=1, keyframe_interval=60, max_bytes=None):
+        self.emulator = emulator
+        self.interval = interval
+        self.keyframe_interval = keyframe_interval
+        self.capacity = max(1, int(seconds * FRAME_RATE / interval))
+        self.max_bytes = max_bytes
+
+        # each group is [frame, keyframe blob, [(frame, delta blob), ...]]
+        self.groups = deque()
+        self.count = 0
+        self.compressed_bytes = 0
+
+        self._frames_since_capture = 0
+        self._scratch = None
+        self._key = None # uncompressed keyframe of the newest group
+
+    @property
+    def memory_usage(self):
+        """ Bytes held by the history, including the uncompressed keyframe """
+        return self.compressed_bytes + (len(self._key) if self._key else 0)
+
+    @property
+    def seconds(self):
+        """ Length of the history currently held """
+        return self.count * self.interval / FRAME_RATE
+
+    def frame_done(self):
+        """ Call once per emulated frame; captures every interval frames """
+        self._frames_since_capture += 1
+        if self._frames_since_capture >= self.interval:
+            self._frames_since_capture = 0
+            self.capture()
+
+    def capture(self):
+        emulator = self.emulator
+        state = self._scratch = emulator.save_state(self._scratch)
+        frame = emulator.frame
+
+        group = self.groups[-1] if self.groups else None
+        if group is None or len(group[2]) + 1 >= self.keyframe_interval or len(state) != len(self._key):
+            self._key = bytes(state)
+            blob = zlib.compress(self._key, 1)
+            self.groups.append([frame, blob, []])
+        else:
+            blob = zlib.compress(_xor_pages(state, self._key), 1)
+            group[2].append((frame, blob))
+        self.count += 1
+        self.compressed_bytes += len(blob)
+        self._evict()
+
+    def step_back(self):
+        """ Restores the newest capture and drops it from the history, so
+        repeated calls walk further back. Returns the restored frame or None
+        once the history is empty. """
+        if not self.groups:
+            return None
+        group = self.groups[-1]
+        key_frame, key_blob, deltas = group
+        key = self._key if self._key is not None else zlib.decompress(key_blob)
+
+        if deltas:
+            frame, blob = deltas.pop()
+            state = _apply_pages(key, zlib.decompress(blob))
+        else:
+            frame, blob = key_frame, key_blob
+            state = key
+            self.groups.pop()
+            key = zlib.decompress(self.groups[-1][1]) if self.groups else None
+        self._key = key
+        self.count -= 1
+        self.compressed_bytes -= len(blob)
+
+        self.emulator.load_state(state)
+        self._frames_since_capture = 0
+        return frame
+
+    def clear(self):
+        self.groups.clear()
+        self.count = 0
+        self.compressed_bytes = 0
+        self._key = None
+
+    def _evict(self):
+        groups = self.groups
+        while len(groups) > 1:
+            oldest = groups[0]
+            size = 1 + len(oldest[2])
+            over_count = self.count - size >= self.capacity
+            over_bytes = self.max_bytes is not None and self.memory_usage > self.max_bytes
+            if not (over_count or over_bytes):
+                break
+            groups.popleft()
+            self.count -= size
+            self.compressed_bytes -= len(oldest[1]) + sum(len(blob) for _, blob in oldest[2])
+
+
+def _xor_pages(state, key):
+    """ Packs the pages of state that differ from key as (index, page ^ key page) """
+    out = bytearray()
+    for start in range(0, len(state), PAGE_SIZE):
+        end = start + PAGE_SIZE
+        page = state[start:end]
+        key_page = key[start:end]
+        if page != key_page:
+            xored = int.from_bytes(page, 'little') ^ int.from_bytes(key_page, 'little')
+            out += (start // PAGE_SIZE).to_bytes(2, 'little')
+            out += xored.to_bytes(len(page), 'little')
+    return out
+
+
+def _apply_pages(key, delta):
+    state = bytearray(key)
+    size = len(key)
+    pos = 0
+    while pos < len(delta):
+        start = int.from_bytes(delta[pos:pos + 2], 'little') * PAGE_SIZE
+        n = min(PAGE_SIZE, size - start)
+        pos += 2
+        xored = int.from_bytes(delta[pos:pos + n], 'little') ^ int.from_bytes(key[start:start + n], 'little')
+        state[start:start + n] = xored.to_bytes(n, 'little')
+        pos += n
+    return state
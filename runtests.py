@@ -0,0 +1,97 @@
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from emulator import CLOCK_SPEED, Emulator
+
+# default budget per ROM: two minutes of emulated time
+DEFAULT_MAX_CYCLES = 120 * CLOCK_SPEED
+
+
+def find_roms(paths):
+    roms = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                roms.extend(os.path.join(root, name) for name in files
+                            if name.lower().endswith(('.gb', '.gbc')))
+        else:
+            roms.append(path)
+    return sorted(roms)
+
+
+def run_rom(path, max_cycles=DEFAULT_MAX_CYCLES, timeout=None):
+    """ Runs one test ROM headlessly until its serial output says Passed or
+    Failed, or a budget runs out. Returns a result dict. """
+    start = time.perf_counter()
+    result = 'timeout'
+    error = None
+    emulator = Emulator(path)
+    serial = emulator.mmu.serial_output
+
+    try:
+        while True:
+            emulator.run_frame()
+            if b'Failed' in serial:
+                result = 'failed'
+                break
+            if b'Passed' in serial:
+                result = 'passed'
+                break
+            if emulator.cycles >= max_cycles:
+                break
+            if timeout is not None and time.perf_counter() - start >= timeout:
+                break
+    except Exception as e:
+        result = 'error'
+        error = f"{type(e).__name__}: {e}"
+
+    return {
+        'rom': path,
+        'result': result,
+        'cycles': emulator.cycles,
+        'seconds': time.perf_counter() - start,
+        'serial': serial.decode('ascii', 'replace'),
+        'error': error,
+    }
+
+
+def print_summary(results, out=sys.stdout):
+    width = max([len(os.path.basename(r['rom'])) for r in results] + [3])
+    out.write(f"{'ROM':<{width}}  {'RESULT':<8} {'CYCLES':>12} {'SECONDS':>8}  DETAIL\n")
+    for r in results:
+        lines = [line for line in r['serial'].splitlines() if line.strip()]
+        detail = r['error'] or (lines[-1].strip() if lines else '')
+        out.write(f"{os.path.basename(r['rom']):<{width}}  {r['result']:<8} "
+                  f"{r['cycles']:>12} {r['seconds']:>8.2f}  {detail}\n")
+    passed = sum(r['result'] == 'passed' for r in results)
+    out.write(f"\n{passed}/{len(results)} passed\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run test ROMs headlessly and report their serial output")
+    parser.add_argument('paths', nargs='*', default=['roms'], help="ROM files or directories")
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--max-cycles', type=int, default=DEFAULT_MAX_CYCLES,
+                        help="emulated cycles allowed per ROM")
+    parser.add_argument('--timeout', type=float, default=None,
+                        help="wall-clock seconds allowed per ROM")
+    args = parser.parse_args(argv)
+
+    roms = find_roms(args.paths)
+    if not roms:
+        print("No ROMs found")
+        return 1
+
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = [pool.submit(run_rom, rom, args.max_cycles, args.timeout) for rom in roms]
+        results = [future.result() for future in futures]
+
+    print_summary(results)
+    return 0 if all(r['result'] == 'passed' for r in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
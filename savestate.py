@@ -0,0 +1,141 @@
+import struct
+
+from apu import SEQUENCER_PERIOD
+
+MAGIC = b'GBST'
+VERSION = 4
+
+# magic, version, emulator cycle count
+HEADER = struct.Struct('<4sHQ')
+# a f b c d e h l, pc, sp, ime (bit 1: EI pending), halted
+CPU_STATE = struct.Struct('<8BHHBB')
+# mode, dots
+PPU_STATE = struct.Struct('<BI')
+# rom_bank, ram_bank, ram_enabled, banking_mode
+MBC_STATE = struct.Struct('<BBBB')
+# timer counter (DIV is its top byte)
+TIMER_STATE = struct.Struct('<H')
+# held buttons (joypad byte)
+JOYPAD_STATE = struct.Struct('<B')
+# per sound channel: playing, length, length enabled, volume, envelope
+# timer, frequency, sweep timer. The frame sequencer's position follows from
+# the cycle count.
+APU_CHANNEL_STATE = struct.Struct('<BHBBBHB')
+
+# everything above the cartridge ROM: VRAM, cart RAM, WRAM, OAM, IO (timers
+# included), HRAM and IE. The ROM itself is re-mapped from the cartridge image.
+MEMORY_START = 0x8000
+MEMORY_SIZE = 0x10000 - MEMORY_START
+FRAMEBUFFER_SIZE = 160 * 144
+
+CPU_OFFSET = HEADER.size
+PPU_OFFSET = CPU_OFFSET + CPU_STATE.size
+MBC_OFFSET = PPU_OFFSET + PPU_STATE.size
+TIMER_OFFSET = MBC_OFFSET + MBC_STATE.size
+JOYPAD_OFFSET = TIMER_OFFSET + TIMER_STATE.size
+APU_OFFSET = JOYPAD_OFFSET + JOYPAD_STATE.size
+MEMORY_OFFSET = APU_OFFSET + 4 * APU_CHANNEL_STATE.size
+FRAMEBUFFER_OFFSET = MEMORY_OFFSET + MEMORY_SIZE
+STATE_SIZE = FRAMEBUFFER_OFFSET + FRAMEBUFFER_SIZE
+
+# CGB cartridges append the banks kept outside memory: VRAM bank 1, WRAM
+# banks 2-7, then the background and object palettes. The bank selects,
+# KEY1 and the DMA registers are part of IO memory.
+CGB_SIZE = 0x2000 + 6 * 0x1000 + 64 + 64
+
+
+def cpu_registers(cpu):
+    """ CPU state in CPU_STATE field order """
+    return (cpu.a, cpu.f, cpu.b, cpu.c, cpu.d, cpu.e, cpu.h, cpu.l,
+            cpu.pc & 0xFFFF, cpu.sp & 0xFFFF, cpu.ime | cpu.ei_delay << 1, cpu.halted)
+
+
+def apu_channels(apu):
+    """ Sound channel states in APU_CHANNEL_STATE field order """
+    return [(channel.on, channel.length, channel.length_enabled, channel.volume,
+             channel.envelope_timer, channel.frequency, channel.sweep_timer)
+            for channel in apu.live]
+
+
+def cgb_banks(mmu):
+    """ Buffers of the CGB section in order """
+    return [mmu.vram[1]] + mmu.wram[2:] + [mmu.bg_palette, mmu.obj_palette]
+
+
+def state_size(mmu):
+    return STATE_SIZE + (CGB_SIZE if mmu.cgb else 0)
+
+
+def save_state(emulator, out=None):
+    """ Serializes the machine into a state_size() byte blob. Pass a
+    bytearray as out to reuse it instead of allocating a new one. """
+    cpu, mmu, ppu = emulator.cpu, emulator.mmu, emulator.ppu
+    if out is None:
+        out = bytearray(state_size(mmu))
+    view = memoryview(out)
+
+    HEADER.pack_into(out, 0, MAGIC, VERSION, emulator.cycles)
+    CPU_STATE.pack_into(out, CPU_OFFSET, *cpu_registers(cpu))
+    PPU_STATE.pack_into(out, PPU_OFFSET, ppu.mode, ppu.dots)
+    MBC_STATE.pack_into(out, MBC_OFFSET,
+                        mmu.rom_bank, mmu.ram_bank, mmu.ram_enabled, mmu.banking_mode)
+    TIMER_STATE.pack_into(out, TIMER_OFFSET, emulator.timer.counter)
+    JOYPAD_STATE.pack_into(out, JOYPAD_OFFSET, mmu.buttons)
+    emulator.apu.catch_up(emulator.cycles)
+    for number, fields in enumerate(apu_channels(emulator.apu)):
+        APU_CHANNEL_STATE.pack_into(out, APU_OFFSET + number * APU_CHANNEL_STATE.size, *fields)
+    view[MEMORY_OFFSET:FRAMEBUFFER_OFFSET] = memoryview(mmu.memory)[MEMORY_START:]
+    view[FRAMEBUFFER_OFFSET:STATE_SIZE] = ppu.framebuffer
+    if mmu.cgb:
+        offset = STATE_SIZE
+        for bank in cgb_banks(mmu):
+            view[offset:offset + len(bank)] = bank
+            offset += len(bank)
+    return out
+
+
+def load_state(emulator, data):
+    """ Restores a blob from save_state() into the emulator's existing buffers """
+    cpu, mmu, ppu = emulator.cpu, emulator.mmu, emulator.ppu
+    if len(data) != state_size(mmu):
+        raise ValueError(f"savestate is {len(data)} bytes, expected {state_size(mmu)}")
+    magic, version, cycles = HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError("not a savestate")
+    if version != VERSION:
+        raise ValueError(f"unsupported savestate version {version} (expected {VERSION})")
+
+    view = memoryview(data)
+
+    emulator.cycles = cycles
+    (cpu.a, cpu.f, cpu.b, cpu.c, cpu.d, cpu.e, cpu.h, cpu.l,
+     cpu.pc, cpu.sp, ime, cpu.halted) = CPU_STATE.unpack_from(data, CPU_OFFSET)
+    cpu.ime, cpu.ei_delay = ime & 1, ime >> 1
+    ppu.mode, ppu.dots = PPU_STATE.unpack_from(data, PPU_OFFSET)
+    (mmu.rom_bank, mmu.ram_bank, mmu.ram_enabled,
+     mmu.banking_mode) = MBC_STATE.unpack_from(data, MBC_OFFSET)
+    emulator.timer.counter, = TIMER_STATE.unpack_from(data, TIMER_OFFSET)
+    mmu.buttons, = JOYPAD_STATE.unpack_from(data, JOYPAD_OFFSET)
+    apu = emulator.apu
+    for number, channel in enumerate(apu.live):
+        (on, channel.length, channel.length_enabled, channel.volume, channel.envelope_timer,
+         channel.frequency, channel.sweep_timer) = APU_CHANNEL_STATE.unpack_from(
+             data, APU_OFFSET + number * APU_CHANNEL_STATE.size)
+        channel.on = bool(on)
+    apu.steps = cycles // SEQUENCER_PERIOD
+
+    mmu.memory[MEMORY_START:] = view[MEMORY_OFFSET:FRAMEBUFFER_OFFSET]
+    mmu.map_rom_bank()
+    ppu.framebuffer[:] = view[FRAMEBUFFER_OFFSET:STATE_SIZE]
+    if mmu.cgb:
+        offset = STATE_SIZE
+        for bank in cgb_banks(mmu):
+            bank[:] = view[offset:offset + len(bank)]
+            offset += len(bank)
+        mmu.double_speed = mmu.memory[0xFF4D] >> 7
+        mmu.map_vram_bank()
+        mmu.map_wram_bank()
+    # the STAT line follows from the registers restored above
+    ppu.update_stat(request=False)
+    # the frontend has to redraw everything after a jump in time
+    ppu.dirty_lines[:] = b'\x01' * 144
@@ -0,0 +1,105 @@
+import hashlib
+import os
+import zlib
+
+import savestate
+
+
+def rom_hash(rom):
+    return hashlib.sha1(rom).hexdigest()
+
+
+def inputs_hash(inputs, frame):
+    """ Digest of the first frame entries of an input script (one joypad
+    byte per frame). Trailing frames without buttons don't change it, so a
+    short script and its zero-padded form share snapshots. """
+    prefix = bytes(inputs[:frame]).rstrip(b'\x00')
+    return hashlib.sha1(prefix).hexdigest()[:16]
+
+
+class StateCache:
+    """ On-disk cache of savestates keyed by ROM SHA-1, input script prefix
+    and frame number, evicted least recently used first once the directory
+    grows past max_bytes. """
+
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, rom_sha1, inputs, frame):
+        name = f"{rom_sha1}-{inputs_hash(inputs, frame)}-{frame:010d}-v{savestate.VERSION}.state"
+        return os.path.join(self.directory, name)
+
+    def put(self, emulator, inputs=b''):
+        """ Stores the emulator's current state under its current frame """
+        frame = emulator.frame
+        path = self._path(rom_hash(emulator.mmu.rom), inputs, frame)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(zlib.compress(emulator.save_state(), 1))
+        os.replace(tmp, path)
+        self._evict()
+        return path
+
+    def nearest(self, rom_sha1, frame, inputs=b''):
+        """ Returns (frame, state) of the latest snapshot at or before frame
+        taken with the same inputs, or None """
+        prefix = f"{rom_sha1}-"
+        suffix = f"-v{savestate.VERSION}.state"
+        frames = []
+        for name in os.listdir(self.directory):
+            if name.startswith(prefix) and name.endswith(suffix):
+                cached = int(name[:-len(suffix)].rsplit('-', 1)[1])
+                if cached <= frame:
+                    frames.append(cached)
+
+        for cached in sorted(set(frames), reverse=True):
+            path = self._path(rom_sha1, inputs, cached)
+            try:
+                with open(path, 'rb') as f:
+                    state = zlib.decompress(f.read())
+            except FileNotFoundError:
+                continue
+            os.utime(path) # mark as recently used
+            return cached, state
+        return None
+
+    def resume(self, emulator, frame, inputs=b''):
+        """ Loads the nearest snapshot at or before frame into the emulator
+        (which must have its ROM loaded). Returns the frame it resumed from,
+        or None if nothing usable was cached. """
+        hit = self.nearest(rom_hash(emulator.mmu.rom), frame, inputs)
+        if hit is None:
+            return None
+        emulator.load_state(hit[1])
+        return hit[0]
+
+    def start_at(self, emulator, frame, inputs=b'', save_every=600):
+        """ Brings a freshly loaded emulator to frame, resuming from the cache
+        and storing a snapshot every save_every frames and at frame itself """
+        self.resume(emulator, frame, inputs)
+        while emulator.frame < frame:
+            stop = min(frame, (emulator.frame // save_every + 1) * save_every)
+            emulator.run_inputs(inputs, stop - emulator.frame)
+            self.put(emulator, inputs)
+
+    def size(self):
+        return sum(entry.stat().st_size for entry in os.scandir(self.directory)
+                   if entry.name.endswith('.state'))
+
+    def _evict(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.state'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
@@ -0,0 +1,36 @@
+import io
+import os
+import random
+
+import checkops
+from emulator import Emulator
+from replay import frame_digests
+
+SEED = 20260101
+ROM = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'roms', 'cpu_instrs.gb')
+
+
+def _check(check, count):
+    out = io.StringIO()
+    failures = check(count, random.Random(SEED), out)
+    assert failures == 0, out.getvalue()
+
+
+def test_handlers_match_reference():
+    # every opcode and CB opcode, all four handler tables
+    _check(checkops.check_handlers, 5)
+
+
+def test_block_ops_match_stepping():
+    # every recognised loop, including the fallbacks and runs stopping inside a loop
+    _check(checkops.check_blockops, 100)
+
+
+def test_block_ops_frame_hashes():
+    # frame 23 of cpu_instrs ends inside a block copy
+    plain = Emulator(ROM, block_ops=False)
+    batched = Emulator(ROM)
+    for _ in range(30):
+        plain.run_frame()
+        batched.run_frame()
+        assert frame_digests(batched) == frame_digests(plain), f"frame {plain.frame}"
@@ -0,0 +1,46 @@
+DIV = 0xFF04
+TIMA = 0xFF05
+TMA = 0xFF06
+TAC = 0xFF07
+IF = 0xFF0F
+
+# TAC clock select -> cycles per TIMA increment
+TIMA_PERIODS = (1024, 16, 64, 256)
+
+
+class Timer:
+    """ DIV, TIMA, TMA and TAC. DIV is the top byte of a 16-bit counter
+    running at the CPU clock; TIMA counts falling edges of the counter bit
+    selected by TAC and requests the timer interrupt when it overflows. The
+    registers live in IO memory, the counter is the only extra state. """
+    __slots__ = ('memory', 'counter')
+
+    def __init__(self, mmu):
+        self.memory = mmu.memory
+        self.counter = 0
+
+    def step(self, cycles):
+        memory = self.memory
+        old = self.counter
+        counter = old + cycles
+        memory[DIV] = counter >> 8 & 0xFF
+        self.counter = counter & 0xFFFF
+
+        tac = memory[TAC]
+        if tac & 0x04:
+            period = TIMA_PERIODS[tac & 0x03]
+            ticks = counter // period - old // period
+            if ticks:
+                tima = memory[TIMA] + ticks
+                if tima > 0xFF:
+                    # reloads from TMA on every overflow
+                    tma = memory[TMA]
+                    while tima > 0xFF:
+                        tima += tma - 0x100
+                    memory[IF] |= 0x04
+                memory[TIMA] = tima
+
+    def reset_divider(self):
+        """ Any write to DIV clears the whole counter """
+        self.counter = 0
+        self.memory[DIV] = 0
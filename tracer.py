@@ -0,0 +1,171 @@
+import argparse
+import gzip
+import sys
+from array import array
+
+import hooks
+
+# each record is three 64-bit words:
+#   pc | sp << 16 | af << 32 | bc << 48
+#   de | hl << 16 | 4 bytes at pc << 32 (little endian, first byte is the opcode)
+#   cycle count before the instruction
+RECORD_WORDS = 3
+RECORD_BYTES = RECORD_WORDS * 8
+
+
+class Tracer:
+    """ Ring buffer of the last size executed instructions, packed into an
+    array of 64-bit words.
+
+    start() wraps CPU.step through hooks. If stream is a path, every time the
+    ring fills it is appended to that gzip file, so the whole run is kept.
+    When an instruction raises, the last dump_on_crash instructions are
+    written to crash_output in gameboy-doctor format before the exception
+    propagates. """
+
+    def __init__(self, emulator, size=65536, stream=None, dump_on_crash=32, crash_output=sys.stderr):
+        self.emulator = emulator
+        self.size = size
+        self.buffer = array('Q', bytes(size * RECORD_BYTES))
+        self.index = 0 # next word to write
+        self.wrapped = False
+        self.stream_path = stream
+        self.stream = None
+        self.dump_on_crash = dump_on_crash
+        self.crash_output = crash_output
+        self.running = False
+
+    def start(self):
+        if self.running:
+            return
+        if self.stream_path is not None and self.stream is None:
+            self.stream = gzip.open(self.stream_path, 'wb', compresslevel=1)
+        hooks.install(self.emulator.cpu, self, {'step': self._step_wrapper})
+        self.running = True
+
+    def stop(self):
+        if not self.running:
+            return
+        hooks.remove(self.emulator.cpu, self)
+        self.running = False
+        if self.stream is not None:
+            self._write_stream(self.buffer[:self.index])
+            self.stream.close()
+            self.stream = None
+
+    def _write_stream(self, words):
+        if sys.byteorder != 'little':
+            words = array('Q', words)
+            words.byteswap()
+        self.stream.write(words.tobytes())
+
+    def _step_wrapper(self, inner):
+        emulator = self.emulator
+        memory = emulator.mmu.memory
+        buffer = self.buffer
+        end = len(buffer)
+
+        def step(cpu):
+            if cpu.halted:
+                return inner(cpu)
+            pc = cpu.pc
+            i = self.index
+            buffer[i] = pc | cpu.sp << 16 | (cpu.a << 8 | cpu.f) << 32 | (cpu.b << 8 | cpu.c) << 48
+            buffer[i + 1] = ((cpu.d << 8 | cpu.e) | (cpu.h << 8 | cpu.l) << 16
+                             | int.from_bytes(memory[pc:pc + 4], 'little') << 32)
+            buffer[i + 2] = emulator.cycles
+            i += RECORD_WORDS
+            if i == end:
+                if self.stream is not None:
+                    self._write_stream(buffer)
+                i = 0
+                self.wrapped = True
+            self.index = i
+
+            try:
+                return inner(cpu)
+            except Exception:
+                if self.dump_on_crash:
+                    self.crash_output.write(f"Last {self.dump_on_crash} instructions:\n")
+                    for line in self.text(self.dump_on_crash):
+                        self.crash_output.write(line + "\n")
+                raise
+        return step
+
+    def records(self, count=None):
+        """ Oldest to newest (pc, sp, af, bc, de, hl, pcmem, cycle) tuples """
+        words = self.buffer
+        if self.wrapped:
+            order = words[self.index:] + words[:self.index]
+        else:
+            order = words[:self.index]
+        total = len(order) // RECORD_WORDS
+        first = 0 if count is None else max(0, total - count)
+        return [unpack(order[i * RECORD_WORDS:(i + 1) * RECORD_WORDS]) for i in range(first, total)]
+
+    def text(self, count=None):
+        """ The last count records as gameboy-doctor log lines """
+        return [doctor_line(record) for record in self.records(count)]
+
+    def export_text(self, path, count=None):
+        with open(path, 'w') as f:
+            for line in self.text(count):
+                f.write(line + "\n")
+
+
+def unpack(words):
+    first, second, cycle = words
+    return (first & 0xFFFF, (first >> 16) & 0xFFFF, (first >> 32) & 0xFFFF, first >> 48,
+            second & 0xFFFF, (second >> 16) & 0xFFFF, second >> 32, cycle)
+
+
+def doctor_line(record):
+    pc, sp, af, bc, de, hl, pcmem, _ = record
+    mem = ",".join(f"{(pcmem >> (8 * i)) & 0xFF:02X}" for i in range(4))
+    return (f"A:{af >> 8:02X} F:{af & 0xFF:02X} B:{bc >> 8:02X} C:{bc & 0xFF:02X} "
+            f"D:{de >> 8:02X} E:{de & 0xFF:02X} H:{hl >> 8:02X} L:{hl & 0xFF:02X} "
+            f"SP:{sp:04X} PC:{pc:04X} PCMEM:{mem}")
+
+
+def read_stream(path):
+    """ Yields the records of a trace streamed to a gzip file """
+    with gzip.open(path, 'rb') as f:
+        while True:
+            chunk = f.read(RECORD_BYTES * 4096)
+            if not chunk:
+                break
+            words = array('Q')
+            words.frombytes(chunk)
+            if sys.byteorder != 'little':
+                words.byteswap()
+            for i in range(0, len(words), RECORD_WORDS):
+                yield unpack(words[i:i + RECORD_WORDS])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Trace every executed instruction of a ROM")
+    parser.add_argument('rom')
+    parser.add_argument('output', help="gzip file the binary trace is streamed to")
+    parser.add_argument('--frames', type=int, default=60)
+    parser.add_argument('--doctor', metavar='PATH',
+                        help="also write the trace as a gameboy-doctor text log")
+    args = parser.parse_args(argv)
+
+    from emulator import Emulator
+    emulator = Emulator(args.rom)
+    tracer = Tracer(emulator, stream=args.output)
+    tracer.start()
+    try:
+        emulator.run_frames(args.frames)
+    finally:
+        tracer.stop()
+
+    if args.doctor:
+        with open(args.doctor, 'w') as f:
+            for record in read_stream(args.output):
+                f.write(doctor_line(record) + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())